@@ -13,18 +13,46 @@ class Database:
     Database object, contains database and cursor used to make changes.
     Functions within operate on the database as part of the simulation
     """
-    def __init__(self, database, telescopes, mode, threshold):
+    def __init__(self, database, telescopes, mode, threshold, in_memory=False, durability='safe', weekly_commits=True,
+                 rng=None, timer=None):
         """
         Constructor that connects to, and stores information about the simulation
         :param database: name of database file for the simulation: str
         :param telescopes: location of telescope file: str
         :param mode: Operating mode to be used in the simulation: str
         :param threshold: Accuracy threshold for the simulation in minutes: int
+        :param in_memory: Load the database file into memory and work there, writing back with flush: bool
+        :param durability: Journal and sync setting for the database file, 'safe', 'wal' or 'fast': str
+        :param weekly_commits: Commit once per simulated week with end_week, rather than after every change: bool
+        :param rng: Random number generator for observation outcomes, from observation_tools.make_rng: Generator
+        :param timer: Records time spent in each phase of the simulation, None to not record: timing_tools.PhaseTimer
         """
         import sqlite3
+        import data_tools
+        import observation_tools
+        import timing_tools
         from datetime import timedelta
-        self.db = sqlite3.connect(database)
+        self.database_name = database
+        self.in_memory = in_memory
+        if in_memory:
+            # copy whole file into a memory database with the backup API
+            source = sqlite3.connect(database)
+            self.db = sqlite3.connect(':memory:')
+            source.backup(self.db)
+            source.close()
+        else:
+            self.db = sqlite3.connect(database)
         self.cursor = self.db.cursor()
+        if not in_memory:
+            self.set_durability(durability)
+        self.weekly_commits = weekly_commits
+        if rng is None:
+            rng = observation_tools.make_rng()
+        self.rng = rng
+        if timer is None:
+            timer = timing_tools.NullTimer()
+        self.timer = timer
+        self.time_format = data_tools.read_time_format(self.cursor)  # storage of times in transit and schedule tables
         self.names = self.read_target_names()
         self.telescope_file = telescopes  # store location
         self.telescope_setup = telescopes.split('/')[-1].split('.')[0]  # store file name
@@ -34,6 +62,92 @@ class Database:
 
         self.total_night = timedelta(days=0)
         self.total_obs = timedelta(days=0)
+        self.night_table = None
+        self.target_table = None
+        self.fits = {}  # running period fits for targets observed during the simulation
+        self.schedule_index = {}  # scheduled observations for each telescope
+
+    def set_durability(self, durability):
+        """
+        Apply journal mode and sync pragmas. All settings keep the database consistent if the simulation crashes,
+        'fast' may lose or corrupt recent commits if the machine itself crashes
+        :param durability: 'safe' for a rollback journal synced at every commit, 'wal' for a write-ahead log synced
+        at checkpoints, or 'fast' for a rollback journal that is never synced: str
+        """
+        if durability == 'safe':
+            journal_mode, synchronous = 'DELETE', 'FULL'
+        elif durability == 'wal':
+            journal_mode, synchronous = 'WAL', 'NORMAL'
+        elif durability == 'fast':
+            journal_mode, synchronous = 'PERSIST', 'OFF'
+        else:
+            raise ValueError('Unknown durability ' + str(durability))
+        self.cursor.execute('PRAGMA journal_mode = ' + journal_mode)
+        self.cursor.execute('PRAGMA synchronous = ' + synchronous)
+
+    def commit(self):
+        """
+        Commit changes made during the simulation, unless they are committed together at the end of the week
+        """
+        if not self.weekly_commits:
+            self.db.commit()
+
+    def end_week(self):
+        """
+        Commit all changes made during a simulated week in one transaction
+        """
+        self.db.commit()
+
+    def flush(self):
+        """
+        Commit changes, and write the whole database back to its file when working in memory
+        """
+        import sqlite3
+        self.db.commit()
+        if self.in_memory:
+            target = sqlite3.connect(self.database_name)
+            self.db.backup(target)
+            target.close()
+            print('Database written to ' + self.database_name)
+
+    def save_checkpoint(self, current_date, time_since_forecast, counts, totals, dates):
+        """
+        Store the state of the simulation loop, with the running totals of telescope time and the state of the random
+        number generator, in the current transaction so it is committed together with the changes it describes
+        :param current_date: Simulated date reached: datetime
+        :param time_since_forecast: Time since the last forecast: timedelta
+        :param counts: Number of constrained targets at every forecasting period so far: list of ints
+        :param totals: Total number of targets at every forecasting period so far: list of ints
+        :param dates: Dates of every forecasting period so far: list of dates
+        """
+        import data_tools
+        from datetime import timedelta
+        microsecond = timedelta(microseconds=1)
+        state = {'CurrentDate': current_date.isoformat(), 'TimeSinceForecast': time_since_forecast // microsecond,
+                 'Counts': [int(count) for count in counts], 'Totals': [int(total) for total in totals],
+                 'Dates': [date.isoformat() for date in dates], 'TotalNight': self.total_night // microsecond,
+                 'TotalObs': self.total_obs // microsecond, 'RNG': self.rng.bit_generator.state}
+        data_tools.write_checkpoint(self.cursor, current_date, state)
+
+    def load_checkpoint(self):
+        """
+        Restore the running totals of telescope time and the random number generator from the latest checkpoint
+        :return current_date: Simulated date reached, None if no checkpoint has been stored: datetime
+        :return time_since_forecast: Time since the last forecast: timedelta
+        :return counts: Number of constrained targets at every forecasting period so far: list of ints
+        :return totals: Total number of targets at every forecasting period so far: list of ints
+        :return dates: Dates of every forecasting period so far: list of dates
+        """
+        import data_tools
+        from datetime import date, datetime, timedelta
+        state = data_tools.read_checkpoint(self.cursor)
+        if state is None:
+            return None, timedelta(days=0), [], [], []
+        self.total_night = timedelta(microseconds=state['TotalNight'])
+        self.total_obs = timedelta(microseconds=state['TotalObs'])
+        self.rng.bit_generator.state = state['RNG']
+        return (datetime.fromisoformat(state['CurrentDate']), timedelta(microseconds=state['TimeSinceForecast']),
+                state['Counts'], state['Totals'], [date.fromisoformat(value) for value in state['Dates']])
 
     def update(self, table, column, row, value):
         """
@@ -43,7 +157,44 @@ class Database:
         :param row: Row to update: str
         :param value: New value: int or float
         """
-        self.cursor.execute('UPDATE '+table+' SET '+column+' = '+str(value)+' WHERE Name = \''+row+'\'')
+        self.cursor.execute('UPDATE '+table+' SET '+column+' = ? WHERE Name = ?', (self.sql_value(value), row))
+
+    def update_target(self, name, values):
+        """
+        Update several columns for a single target in TARGET_DATA with one statement
+        :param name: Name of target: str
+        :param values: New values for each column, None or 'NULL' for NULL: dict
+        """
+        self.update_targets([(name, values)])
+
+    def update_targets(self, updates):
+        """
+        Update several columns for many targets in TARGET_DATA, one executemany for each set of columns updated
+        :param updates: List of (name, values) pairs, values being a dict of new values for each column
+        """
+        # group updates by the columns they set, keeping the order of the first update for each group
+        groups = {}
+        for name, values in updates:
+            columns = tuple(values)
+            row = tuple(self.sql_value(values[column]) for column in columns) + (name,)
+            groups.setdefault(columns, []).append(row)
+
+        for columns, rows in groups.items():
+            self.cursor.executemany('UPDATE TARGET_DATA SET ' + ', '.join(column + ' = ?' for column in columns) +
+                                    ' WHERE Name = ?', rows)
+
+    @staticmethod
+    def sql_value(value):
+        """
+        Convert value to a type that can be bound to an SQL statement
+        :param value: Value to convert
+        :return: Converted value, None for NULL
+        """
+        if isinstance(value, str) and value == 'NULL':
+            return None
+        if hasattr(value, 'item'):  # numpy scalar
+            return value.item()
+        return value
 
     def read_target_names(self):
         """
@@ -90,53 +241,54 @@ class Database:
         Perform initial period fit for each target based on initial observation data
         :return:
         """
+        import numpy as np
         import data_tools
         total = len(self.names)
         count = 1
-        for target in self.names:
-            obs = data_tools.read_obs_data(self.cursor, target)  # load target data
-            try:
-                print('Fitting ' + target + ' ('+str(count)+'/'+str(total)+')')
-                # perform fit
-                fit_period, fit_period_err, latest_tmid, latest_tmid_err, latest_epoch = data_tools.period_fit(obs)
-                # store values in table
-                self.update('TARGET_DATA', 'FitPeriod', target, fit_period)
-                self.update('TARGET_DATA', 'FitPeriodErr', target, fit_period_err)
-                self.update('TARGET_DATA', 'CurrentPeriod', target, fit_period)
-                self.update('TARGET_DATA', 'CurrentPeriodErr', target, fit_period_err)
-                self.update('TARGET_DATA', 'TruePeriod', target, fit_period)
-                self.update('TARGET_DATA', 'TruePeriodErr', target, fit_period_err)
-                self.update('TARGET_DATA', 'TrueEpoch', target, latest_epoch)
-                self.update('TARGET_DATA', 'TrueLastObs', target, latest_tmid)
-                self.update('TARGET_DATA', 'TrueLastObsErr', target, latest_tmid_err)
-
-                # check for missing error data on last observation and store latest value with error available
-                if self.cursor.execute('SELECT LastObsErr FROM TARGET_DATA WHERE Name = \''+target+'\'').fetchall()[0]\
-                        is None:
-                    self.update('TARGET_DATA', 'LastObs', target, latest_tmid)
-                    self.update('TARGET_DATA', 'LastObsErr', target, latest_tmid_err)
-                    self.update('TARGET_DATA', 'LastEpoch', target, latest_epoch)
-
-                # check for new latest observation
-                elif latest_tmid > self.cursor.execute('SELECT LastObs FROM TARGET_DATA WHERE '
-                                                       'Name = \''+target+'\'').fetchall()[0][0]:
-                    self.update('TARGET_DATA', 'LastObs', target, latest_tmid)
-                    self.update('TARGET_DATA', 'LastObsErr', target, latest_tmid_err)
-                    self.update('TARGET_DATA', 'LastEpoch', target, latest_epoch)
-
-            except Warning:  # thrown by period_fit
-                print('Fit for ' + target + ' failed, has '+str(len(obs))+' observations')
-                self.cursor.execute(
-                    'UPDATE TARGET_DATA SET CurrentPeriod = PeriodStart, CurrentPeriodErr = PeriodStartErr WHERE '
-                    'FitPeriod IS NULL')
-                self.cursor.execute(
-                    'UPDATE TARGET_DATA SET TruePeriod = PeriodStart, TruePeriodErr = PeriodStartErr WHERE FitPeriod IS'
-                    ' NULL')
-                self.cursor.execute('UPDATE TARGET_DATA SET TrueEpoch = LastEpoch WHERE TrueEpoch IS NULL')
-
-            finally:
-                count += 1
-                self.db.commit()
+        # load observations for all targets and fit them together
+        index, epochs, tmids, tmid_errs = data_tools.read_obs_arrays(self.cursor, self.names)
+        fit_periods, fit_period_errs, latest_tmids, latest_tmid_errs, latest_epochs, fitted = \
+            data_tools.period_fit_batch(index, epochs, tmids, tmid_errs, total)
+        no_of_obs = np.bincount(index, minlength=total)
+        # current latest observations, to check against those in the fit
+        last_obs = dict(self.cursor.execute('SELECT Name, LastObs FROM TARGET_DATA').fetchall())
+        updates = []
+        failed = False
+        for i, target in enumerate(self.names):
+            print('Fitting ' + target + ' ('+str(count)+'/'+str(total)+')')
+            count += 1
+            if not fitted[i]:
+                print('Fit for ' + target + ' failed, has '+str(no_of_obs[i])+' observations')
+                failed = True
+                continue
+
+            fit_period, fit_period_err = float(fit_periods[i]), float(fit_period_errs[i])
+            latest_tmid, latest_tmid_err = float(latest_tmids[i]), float(latest_tmid_errs[i])
+            latest_epoch = float(latest_epochs[i])
+            # store values in table
+            values = {'FitPeriod': fit_period, 'FitPeriodErr': fit_period_err, 'CurrentPeriod': fit_period,
+                      'CurrentPeriodErr': fit_period_err, 'TruePeriod': fit_period, 'TruePeriodErr': fit_period_err,
+                      'TrueEpoch': latest_epoch, 'TrueLastObs': latest_tmid, 'TrueLastObsErr': latest_tmid_err}
+
+            # check for new latest observation
+            if last_obs[target] is None or latest_tmid > last_obs[target]:
+                values['LastObs'] = latest_tmid
+                values['LastObsErr'] = latest_tmid_err
+                values['LastEpoch'] = latest_epoch
+            updates.append((target, values))
+
+        self.update_targets(updates)
+
+        # fall back to starting periods for targets without a fit
+        if failed:
+            self.cursor.execute(
+                'UPDATE TARGET_DATA SET CurrentPeriod = PeriodStart, CurrentPeriodErr = PeriodStartErr WHERE '
+                'FitPeriod IS NULL')
+            self.cursor.execute(
+                'UPDATE TARGET_DATA SET TruePeriod = PeriodStart, TruePeriodErr = PeriodStartErr WHERE FitPeriod IS'
+                ' NULL')
+            self.cursor.execute('UPDATE TARGET_DATA SET TrueEpoch = LastEpoch WHERE TrueEpoch IS NULL')
+        self.db.commit()
 
     def initial_prop_to_ariel(self):
         """
@@ -149,20 +301,19 @@ class Database:
             'SELECT Name, CurrentPeriod, CurrentPeriodErr, LastObs, LastObsErr, Duration FROM TARGET_DATA '
             'WHERE CurrentPeriodErr NOT NULL AND LastObsErr NOT NULL')
         rows = self.cursor.fetchall()
-        # for each target
-        for row in rows:
-            name = row[0]
-            try:
-                err_tot, percent, loss = data_tools.prop_forwards(row)  # calculate propagated error
-                # store values in table
-                self.update('TARGET_DATA', 'ErrAtAriel', name, err_tot)
-                self.update('TARGET_DATA', 'PercentLoss', name, percent)
-                self.update('TARGET_DATA', 'LossAtAriel', name, loss)
-                self.update('TARGET_DATA', 'ErrAtArielStart', name, err_tot)
-                self.update('TARGET_DATA', 'PercentLossStart', name, percent)
-                self.update('TARGET_DATA', 'LossAtArielStart', name, loss)
-            except Warning:
-                pass
+        if len(rows) == 0:
+            return
+        # calculate propagated errors for all targets at once
+        names, periods, period_errs, tmids, tmid_errs, durations = zip(*rows)
+        errs_tot, percents, losses = data_tools.prop_forwards_batch(periods, period_errs, tmids, tmid_errs, durations)
+        # store values for all targets at once
+        updates = []
+        for name, err_tot, percent, loss in zip(names, errs_tot, percents, losses):
+            err_tot, percent, loss = float(err_tot), float(percent), bool(loss)
+            updates.append((name, {'ErrAtAriel': err_tot, 'PercentLoss': percent, 'LossAtAriel': loss,
+                                   'ErrAtArielStart': err_tot, 'PercentLossStart': percent, 'LossAtArielStart': loss}))
+        self.update_targets(updates)
+        self.db.commit()
 
     def transit_forecast(self, start, end):
         """
@@ -171,8 +322,8 @@ class Database:
         :param end: End of forecast window: datetime
         """
         import observation_tools
+        import data_tools
         import julian
-        import mini_staralt
 
         #  make table for transit data if not exists
         self.cursor.execute(
@@ -182,9 +333,11 @@ class Database:
 
         start_jd = julian.to_jd(start, fmt='jd') - 2400000  # convert start to JD format in table
         # select targets with deep transits and discovery dates in the past, AND require further observation
-        rows = self.cursor.execute('SELECT Name FROM TARGET_DATA WHERE Depth > 10.0 AND "' + str(
-            start_jd) + '" > LastObs AND (ErrAtAriel*24*60 > ' + str(
-            self.threshold) + ' OR ErrAtAriel IS NULL)').fetchall()
+        # in insertion order, the index on Depth would otherwise give the rows in order of depth
+        # +rowid keeps the index search and sorts the matches, rather than scanning the table in rowid order
+        rows = self.cursor.execute('SELECT Name FROM TARGET_DATA WHERE Depth > 10.0 AND ? > LastObs AND '
+                                   '(ErrAtAriel*24*60 > ? OR ErrAtAriel IS NULL) ORDER BY +rowid',
+                                   (start_jd, self.threshold)).fetchall()
 
         # obtain deep names and reset names in database
         deep_names = []
@@ -193,24 +346,27 @@ class Database:
         self.names = deep_names
 
         # for each deep target
+        rows = []
         for name in self.names:
             data = observation_tools.read_data(self.cursor, name)
             transits = observation_tools.transit_forecast(data, name, start, end)  # forecast transits for target
 
             for transit in transits:
-                # add new transit to the table
-                string = 'INSERT INTO DEEP_TRANSITS (Center, Name, Ingress, Egress, Duration, RA, Dec, PercentLoss, ' \
-                         'Epoch, ErrAtAriel) VALUES ( \'' + str(transit.center) + '\', \'' + transit.name + '\', \'' \
-                         + str(transit.ingress) + '\', \'' + str(transit.egress) + '\', \'' + str(
-                            transit.duration) + '\', ' + str(transit.ra) + ', ' + str(transit.dec) + ', '
-                # check for missing error values and modify string accordingly
+                # collect new transit, leaving loss NULL where error values are missing
                 if transit.error is None:
-                    string += 'NULL, ' + str(transit.epoch) + ', NULL)'
+                    loss = None
                 else:
-                    string += str(transit.loss) + ', ' + str(transit.epoch) + ', ' + str(transit.error) + ')'
-                self.cursor.execute(string)
-
-        self.db.commit()
+                    loss = transit.loss
+                rows.append((data_tools.time_to_value(transit.center, self.time_format), transit.name,
+                             data_tools.time_to_value(transit.ingress, self.time_format),
+                             data_tools.time_to_value(transit.egress, self.time_format),
+                             data_tools.duration_to_value(transit.duration, self.time_format), transit.ra, transit.dec,
+                             loss, transit.epoch, transit.error))
+
+        # add all new transits to the table at once
+        self.cursor.executemany('INSERT INTO DEEP_TRANSITS (Center, Name, Ingress, Egress, Duration, RA, Dec, '
+                                'PercentLoss, Epoch, ErrAtAriel) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        self.commit()
 
     def load_telescope_data(self):
         """
@@ -238,17 +394,23 @@ class Database:
         import observation_tools
         # find transits in window
         end_date = start_date + interval
-        self.cursor.execute('SELECT * FROM DEEP_TRANSITS WHERE Center BETWEEN "' + str(start_date.date()) + ' 00:00:00"'
-                            ' AND "' + str(end_date.date()) + ' 00:00:00"')
+        self.cursor.execute('SELECT * FROM DEEP_TRANSITS WHERE Center BETWEEN ? AND ? ORDER BY rowid',
+                            self.date_range(start_date, end_date))
         rows = self.cursor.fetchall()
         self.load_telescope_data()  # store telescopes in object
-        transits = []
-        # for each transit
+        new_transits = []
         for row in rows:
             new_transit = observation_tools.Transit()
-            new_transit.gen_from_database(row)
+            new_transit.gen_from_database(row, self.time_format)
+            new_transits.append(new_transit)
+        if self.target_table is not None:
+            self.target_table.prepare(new_transits)  # target windows for every transit at once
+
+        transits = []
+        # for each transit
+        for new_transit in new_transits:
             # check visibility from telescopes available
-            if new_transit.check_visibility_telescopes(self.telescope_data):
+            if new_transit.check_visibility_telescopes(self.telescope_data, self.night_table, self.target_table):
                 # check for missing propagated error values and set to high values
                 if new_transit.error is None:
                     new_transit.loss = 1000
@@ -272,7 +434,8 @@ class Database:
         """
         import numpy as np
 
-        transits = self.obtain_upcoming_transits(start_date, interval)
+        with self.timer.phase('obtain_upcoming_transits'):
+            transits = self.obtain_upcoming_transits(start_date, interval)
 
         # check each telescope against all transits
         for telescope in self.telescope_data:
@@ -290,7 +453,8 @@ class Database:
                 print('NO VALID MODE SPECIFIED')
                 raise IOError
 
-            self.schedule(matching_transits, limit, telescope.name)  # make schedule
+            with self.timer.phase('schedule'):
+                self.schedule(matching_transits, limit, telescope.name)  # make schedule
 
     def schedule(self, transits, limit, telescope):
         """
@@ -300,70 +464,55 @@ class Database:
         :param limit: Maximum number of observations allowed in the interval
         :param telescope: Name of telescope being scheduled
         """
-        from datetime import datetime, timedelta
+        from datetime import timedelta
         from sqlite3 import IntegrityError
+        import data_tools
+
+        # obtain index of already scheduled observations
+        index = self.load_schedule_index(telescope)
 
         new_transits = 0  # set limit counter
         while new_transits < limit:  # loop while limit not reached
             # iterate through transits
             for transit in transits:
-                # check already scheduled observations
-                scheduled = self.cursor.execute('SELECT RunStart, RunEnd FROM "'+telescope+'"').fetchall()
                 # set start and finish times including continuum observation time
                 continuum = timedelta(minutes=45)
                 new_start = transit.ingress - continuum
                 new_end = transit.egress + continuum
                 duration = new_end - new_start  # find duration
-                # check for empty schedule and schedule transit if empty
-                if len(scheduled) == 0:
+                # check for space in schedule and schedule transit if available
+                if not index.overlaps(new_start, new_end):
                     try:
-                        self.cursor.execute(
-                            'INSERT INTO ' + telescope + ' VALUES ("' + transit.name + '", ' + str(transit.ra) +
-                            ', ' + str(transit.dec) + ', "' + str(transit.center) + '", "' + str(
-                                new_start) + '", "' + str(new_end) + '", "' +
-                            str(duration) + '", ' + str(transit.epoch) + ')')
-
+                        self.cursor.execute('INSERT INTO ' + telescope + ' VALUES (?, ?, ?, ?, ?, ?, ?, ?)', (
+                            transit.name, transit.ra, transit.dec,
+                            data_tools.time_to_value(transit.center, self.time_format),
+                            data_tools.time_to_value(new_start, self.time_format),
+                            data_tools.time_to_value(new_end, self.time_format),
+                            data_tools.duration_to_value(duration, self.time_format), transit.epoch))
+
+                        index.add(new_start, new_end)  # keep index in step with table
                         new_transits += 1  # increment number of scheduled observations
                         self.total_obs += transit.duration  # add to total scheduled time
                     except IntegrityError:
                         pass
-                # if schedule is not empty, need to check for space in schedule
-                else:
-                    space = True
-                    for single in scheduled:  # check for each scheduled observations
-                        # obtain start and end times
-                        try:
-                            start_time = datetime.strptime(single[0], '%Y-%m-%d %H:%M:%S.%f')
-                            end_time = datetime.strptime(single[1], '%Y-%m-%d %H:%M:%S.%f')
-                        except ValueError:
-                            start_time = datetime.strptime(single[0], '%Y-%m-%d %H:%M:%S')
-                            end_time = datetime.strptime(single[1], '%Y-%m-%d %H:%M:%S')
-
-                        if start_time < new_start < end_time:  # new observation starts before current one ends
-                            space = False
-                        if start_time < new_end < end_time:  # new observation ends after current one starts
-                            space = False
-                        if new_start < start_time and end_time < new_end:  # new observation surrounds current one
-                            space = False
-
-                    if space:  # schedule if space is available
-                        try:
-                            self.cursor.execute(
-                                'INSERT INTO ' + telescope + ' VALUES ("' + transit.name + '", ' + str(
-                                    transit.ra) +
-                                ', ' + str(transit.dec) + ', "' + str(transit.center) + '", "' + str(
-                                    new_start) + '", "' + str(new_end) + '", "' +
-                                str(duration) + '", ' + str(transit.epoch) + ')')
-
-                            new_transits += 1  # increment number of scheduled observations
-                            self.total_obs += transit.duration  # add to total scheduled time
-                        except IntegrityError:
-                            pass
 
-            self.db.commit()
+            self.commit()
             # break when limit reached
             break
 
+    def load_schedule_index(self, telescope):
+        """
+        Obtain index of observations scheduled on a telescope, reading the schedule table the first time
+        :param telescope: Name of telescope: str
+        :return: ScheduleIndex object
+        """
+        import observation_tools
+        if telescope not in self.schedule_index:
+            index = observation_tools.ScheduleIndex()
+            index.gen_from_database(self.cursor, telescope, self.time_format)
+            self.schedule_index[telescope] = index
+        return self.schedule_index[telescope]
+
     def simulate_observations(self, start_date, interval):
         """
         Simulate the observation of transits scheduled for each telescope, generate data, and add to database
@@ -371,42 +520,48 @@ class Database:
         :param interval: Length of window: timedelta
         """
         import observation_tools
+        import data_tools
         end_date = start_date + interval
-        # observe for each telescope
+        # obtain schedule for each telescope
+        scheduled = []
         for telescope in self.telescope_data:
-            # obtain schedule
-            self.cursor.execute('SELECT * FROM "' + telescope.name + '" WHERE ObsCenter BETWEEN "' + str(
-                start_date.date()) + ' 00:00:00" AND "' + str(end_date.date()) + ' 00:00:00"')
-            observations = self.cursor.fetchall()
-
-            # "observe" each transit
-            for observation in observations:
-                success = observation_tools.flip_unfair_coin()  # determine success of observation at random
-
-                if success:
-                    print('Observed ' + observation[0] + ' from ' + telescope.name + ' at ' + str(observation[3]))
-
-                    # obtain current data for target
-                    self.cursor.execute(
-                        'SELECT LastObs, LastObsErr, LastEpoch, CurrentPeriod, TrueLastObs, TruePeriod, TrueEpoch FROM '
-                        'TARGET_DATA WHERE Name = "' + observation[0] + '"')
-                    data = self.cursor.fetchall()[0]
-                    new_epoch = observation[-1]  # obtain epoch for new observation
-                    last_tmid, last_tmid_err, last_epoch, period, true_t0, true_period, true_epoch = \
-                        data[0], data[1], data[2], data[3], data[4], data[5], data[6]
-
-                    # generate new data based on target information
-                    new_tmid, new_tmid_err = observation_tools.generate_results(last_tmid, last_tmid_err, last_epoch,
-                                                                                new_epoch, period)
-                    # obtain true ephemeris based on expected period
-                    if true_t0 is not None:
-                        true_center = observation_tools.find_true_t0(true_t0, true_period, true_epoch, new_epoch)
-                    else:
-                        true_center = 'NULL'
-                    # add new observation to the database
-                    self.add_new_observation(observation[0], new_epoch, new_tmid, new_tmid_err,
-                                             telescope.name, true_center)
-                    self.db.commit()
+            self.cursor.execute('SELECT * FROM "' + telescope.name + '" WHERE ObsCenter BETWEEN ? AND ? ORDER BY rowid',
+                                self.date_range(start_date, end_date))
+            for observation in self.cursor.fetchall():
+                scheduled.append((telescope, observation))
+
+        # determine success and results of every observation in the week at random, in one draw each
+        successes = observation_tools.flip_unfair_coins(self.rng, len(scheduled))
+        tmid_offsets, tmid_errs = observation_tools.draw_result_noise(self.rng, len(scheduled))
+
+        # "observe" each transit
+        for i, (telescope, observation) in enumerate(scheduled):
+            if successes[i]:
+                print('Observed ' + observation[0] + ' from ' + telescope.name + ' at ' +
+                      str(data_tools.value_to_time(observation[3], self.time_format)))
+
+                # obtain current data for target
+                self.cursor.execute(
+                    'SELECT LastObs, LastObsErr, LastEpoch, CurrentPeriod, TrueLastObs, TruePeriod, TrueEpoch FROM '
+                    'TARGET_DATA WHERE Name = "' + observation[0] + '"')
+                data = self.cursor.fetchall()[0]
+                new_epoch = observation[-1]  # obtain epoch for new observation
+                last_tmid, last_tmid_err, last_epoch, period, true_t0, true_period, true_epoch = \
+                    data[0], data[1], data[2], data[3], data[4], data[5], data[6]
+
+                # generate new data based on target information
+                new_tmid, new_tmid_err = observation_tools.generate_results(last_tmid, last_tmid_err, last_epoch,
+                                                                            new_epoch, period, tmid_offsets[i],
+                                                                            tmid_errs[i])
+                # obtain true ephemeris based on expected period
+                if true_t0 is not None:
+                    true_center = observation_tools.find_true_t0(true_t0, true_period, true_epoch, new_epoch)
+                else:
+                    true_center = 'NULL'
+                # add new observation to the database
+                self.add_new_observation(observation[0], new_epoch, new_tmid, new_tmid_err,
+                                         telescope.name, true_center)
+                self.commit()
 
     def add_new_observation(self, name, epoch, tmid, tmid_err, telescope, true_center):
         """
@@ -420,23 +575,43 @@ class Database:
         :return:
         """
         import observation_tools
+        import data_tools
         from sqlite3 import IntegrityError
 
         # find new observation ID
-        ids_raw = self.cursor.execute('SELECT ObID FROM "' + name + '"').fetchall()
+        ids_raw = data_tools.read_obs_ids(self.cursor, name)
         new_id = observation_tools.find_highest_id(ids_raw)
 
         # insert into database
         try:
-            self.cursor.execute('INSERT INTO "' + name + '" (ObID, Epoch, ObsCenter, ObsCenterErr, TrueCenter, Source) '
-                                                         'VALUES (' + str(new_id) + ', ' + str(epoch) + ', '
-                                + str(tmid) + ', ' + str(tmid_err) + ', ' + str(true_center)+', "'+telescope + '")')
-            self.cursor.execute('UPDATE TARGET_DATA SET NoOfObs = NoOfObs + 1 WHERE Name = "'+name+'"')
-            self.db.commit()
+            data_tools.insert_observation(self.cursor, name, {'ObID': new_id, 'Epoch': epoch, 'ObsCenter': tmid,
+                                                              'ObsCenterErr': tmid_err, 'TrueCenter': true_center,
+                                                              'Source': telescope})
+            self.cursor.execute('UPDATE TARGET_DATA SET NoOfObs = NoOfObs + 1 WHERE Name = ?', (name,))
+            self.commit()
+            # add to running fit, if not loaded yet it will be read from the database including this observation
+            if name in self.fits:
+                self.fits[name].add(epoch, tmid, tmid_err)
         except IntegrityError:
             pass
 
-        self.recalculate(name)  # trigger recalculation based on new data
+        with self.timer.phase('recalculate'):
+            self.recalculate(name)  # trigger recalculation based on new data
+
+    def load_fit(self, name):
+        """
+        Obtain running period fit for a target, reading its observations from the database the first time
+        :param name: Name of target: str
+        :return: EphemerisFit object
+        """
+        import data_tools
+        if name not in self.fits:
+            period = self.cursor.execute('SELECT CurrentPeriod FROM TARGET_DATA WHERE Name = ?', (name,)).fetchall()
+            reference_period = period[0][0] if len(period) != 0 and period[0][0] is not None else 0.0
+            fit = data_tools.EphemerisFit(float(reference_period))
+            fit.add_observations(data_tools.read_obs_data(self.cursor, name))
+            self.fits[name] = fit
+        return self.fits[name]
 
     def recalculate(self, name):
         """
@@ -451,66 +626,64 @@ class Database:
         # PERIOD FIT SECTION #
         ######################
 
-        # obtain current observations
-        observations = data_tools.read_obs_data(self.cursor, name)
-        # fit new period and update table values
+        # obtain running fit of current observations and current data for target
+        fit = self.load_fit(name)
+        data = self.cursor.execute('SELECT Name, CurrentPeriod, CurrentPeriodErr, LastObs, LastObsErr, Duration FROM '
+                                   'TARGET_DATA WHERE Name = ?', (name,)).fetchall()
+        if len(data) == 0:  # check for failed SELECT
+            return
+        data_row = list(data[0])
+        values = {}
+        # fit new period and store new values
         try:
-            new_period, new_period_err, tmid_max, tmid_max_err, last_epoch = data_tools.period_fit(observations)
-            self.update('TARGET_DATA', 'CurrentPeriod', name, new_period)
-            self.update('TARGET_DATA', 'CurrentPeriodErr', name, new_period_err)
-            self.update('TARGET_DATA', 'LastObs', name, tmid_max)
-            self.update('TARGET_DATA', 'LastObsErr', name, tmid_max_err)
-            self.update('TARGET_DATA', 'LastEpoch', name, last_epoch)
-            #self.update('TARGET_DATA', 'TrueLastObs', name, true_center)
+            new_period, new_period_err, tmid_max, tmid_max_err, last_epoch = fit.result()
+            values = {'CurrentPeriod': new_period, 'CurrentPeriodErr': new_period_err, 'LastObs': tmid_max,
+                      'LastObsErr': tmid_max_err, 'LastEpoch': last_epoch}
+            data_row[1:5] = new_period, new_period_err, tmid_max, tmid_max_err
         except Warning:
             # insufficient observations for period fit, 3 required
-            if observations is None:
-                print('Fit for '+name+'failed, has no observations')
+            if fit.count != 1:
+                print('Fit for '+name+' failed, has '+str(fit.count)+' observations')
             else:
-                if len(observations) != 1:
-                    print('Fit for '+name+' failed, has '+str(len(observations))+' observations')
-                else:
-                    print('Fit for ' + name + ' failed, has ' + str(len(observations)) + ' observation')
+                print('Fit for ' + name + ' failed, has ' + str(fit.count) + ' observation')
         except TypeError:
             pass
-        self.db.commit()
 
         ######################
         # ERROR PROP SECTION #
         ######################
 
-        # obtain current data for target after period fit
-        self.cursor.execute(
-            'SELECT Name, CurrentPeriod, CurrentPeriodErr, LastObs, LastObsErr, Duration FROM TARGET_DATA '
-            'WHERE CurrentPeriodErr NOT NULL AND LastObsErr NOT NULL AND Name = \'' + name + '\'')
-        data = self.cursor.fetchall()
-        if len(data) != 0:  # check for failed SELECT
-            data_row = data[0]
+        # check for complete data after period fit
+        if data_row[2] is not None and data_row[4] is not None:
             # check if ARIEL launch has been reached
             if data_row[3] < (julian.to_jd(datetime.datetime(year=2030, month=6, day=12, hour=0, minute=0, second=0),
                                            fmt='jd') - 2400000):
-                # repropagate and store results in table
+                # repropagate and store results
                 err_tot, percent, loss = data_tools.prop_forwards(data_row)
-                self.update('TARGET_DATA', 'ErrAtAriel', name, err_tot)
-                self.update('TARGET_DATA', 'PercentLoss', name, percent)
-                self.update('TARGET_DATA', 'LossAtAriel', name, loss)
+                values['ErrAtAriel'] = err_tot
+                values['PercentLoss'] = percent
+                values['LossAtAriel'] = loss
+
+        # update table values at once
+        if len(values) != 0:
+            self.update_target(name, values)
+        self.commit()
 
     def find_earliest_date(self):
         """
         Find date of earliest transit in database
         :return:
         """
-        import datetime
-        self.cursor.execute('SELECT Center FROM DEEP_TRANSITS')  # find all transits
-        rows = self.cursor.fetchall()
-        lowest = min(rows)  # find earliest date
-        return datetime.datetime.strptime(lowest[0], '%Y-%m-%d %H:%M:%S.%f')  # convert to datetime and return
+        import data_tools
+        lowest = self.cursor.execute('SELECT MIN(Center) FROM DEEP_TRANSITS').fetchone()  # find earliest date
+        return data_tools.value_to_time(lowest[0], self.time_format)  # convert to datetime and return
 
-    def store_results(self, count, total):
+    def store_results(self, count, total, results_file='../results.db'):
         """
-        Store running total data in results table
+        Store running total data in results table, and in the results table shared by all simulations
         :param count: Number of constrained targets: int
         :param total: Total targets in simulation: int
+        :param results_file: Location of shared results database: str
         """
         import sqlite3
         # create results table
@@ -529,7 +702,7 @@ class Database:
                             + str(self.total_night)+'", "'+str(self.total_obs)+'", '+str(percent_usage)+')')
         self.db.commit()
 
-        results_db = sqlite3.connect('../results.db')
+        results_db = sqlite3.connect(results_file, timeout=60)  # wait for other simulations writing results
         results_cursor = results_db.cursor()
         results_cursor.execute('CREATE TABLE IF NOT EXISTS RESULTS (Network VARCHAR(25), Mode VARCHAR(25), Accuracy REAL, '
                             'Constrained REAL, Total REAL, PercentTargets REAL, TotalNight TIME, TotalObsTime TIME, PercentUsage REAL)')
@@ -547,40 +720,99 @@ class Database:
         """
         import julian
         current_jd = julian.to_jd(current, fmt='jd') - 2400000  # convert to JD format used in table
-        # find all deep targets
-        total = len(self.cursor.execute(
-            'SELECT Name FROM TARGET_DATA WHERE LastObs < ' + str(current_jd) + ' AND Depth > 10.0').fetchall())
-        # find all constrained deep targets
-        count = len(self.cursor.execute('SELECT Name FROM TARGET_DATA WHERE LastObs < '+str(current_jd)+' '
-                                        'AND Depth > 10.0 AND ErrAtAriel*24*60 < '+str(self.threshold)).fetchall())
+        # count all deep targets
+        total = self.cursor.execute('SELECT COUNT(*) FROM TARGET_DATA WHERE LastObs < ? AND Depth > 10.0',
+                                    (current_jd,)).fetchone()[0]
+        # count all constrained deep targets
+        count = self.cursor.execute('SELECT COUNT(*) FROM TARGET_DATA WHERE LastObs < ? AND Depth > 10.0 AND '
+                                    'ErrAtAriel*24*60 < ?', (current_jd, self.threshold)).fetchone()[0]
         print('Constrained '+str(count)+'/'+str(total)+' targets on '+str(current.date()))
         return count, total
 
-    def increment_total_night(self, start, interval):
+    def date_range(self, start, end):
         """
-        Keep a running total of the total available observing hours through out simulation by calculating sunset and
-        rise for each day in specified window
-        :param start: Start of window: datetime
-        :param interval: Length of window: datetime
+        Bounds for selecting stored times between midnight of two dates
+        :param start: First date: datetime
+        :param end: Last date: datetime
+        :return: Stored values for the two midnights: tuple
         """
-        from datetime import timedelta
-        import mini_staralt
-
-        end = start + interval
-        day = timedelta(days=1)
-
-        while start < end:
-            for telescope in self.telescope_data:
-                sunset, sunrise = mini_staralt.sun_set_rise(start, lon=telescope.lon, lat=telescope.lat, sundown=-12)
-                duration = sunrise - sunset
-                self.total_night += duration
-
-            start += day
-
+        import data_tools
+        start = start.replace(hour=0, minute=0, second=0, microsecond=0)
+        end = end.replace(hour=0, minute=0, second=0, microsecond=0)
+        return data_tools.time_to_value(start, self.time_format), data_tools.time_to_value(end, self.time_format)
 
+    def create_indexes(self):
+        """
+        Create the indexes used by the range and count queries made every interval of the simulation
+        """
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS DEEP_TRANSITS_CENTER ON DEEP_TRANSITS(Center)')
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS TARGET_DATA_DEPTH ON TARGET_DATA(Depth, LastObs, ErrAtAriel)')
+        self.load_telescope_data()
+        for telescope in self.telescope_data:
+            self.cursor.execute('CREATE INDEX IF NOT EXISTS "' + telescope.name + '_OBSCENTER" ON "' + telescope.name +
+                                '"(ObsCenter)')
+        self.db.commit()
 
+    def check_query_plans(self):
+        """
+        Find any of the queries made every interval of the simulation that would scan a whole table
+        :return: List of (query, plan detail) for each query not using an index
+        """
+        # representative parameters, the plan does not depend on the values
+        date = '2020-01-01 00:00:00'
+        queries = [('SELECT MIN(Center) FROM DEEP_TRANSITS', ()),
+                   ('SELECT * FROM DEEP_TRANSITS WHERE Center BETWEEN ? AND ? ORDER BY rowid', (date, date)),
+                   ('SELECT COUNT(*) FROM TARGET_DATA WHERE LastObs < ? AND Depth > 10.0', (0,)),
+                   ('SELECT COUNT(*) FROM TARGET_DATA WHERE LastObs < ? AND Depth > 10.0 AND ErrAtAriel*24*60 < ?',
+                    (0, 0)),
+                   ('SELECT Name FROM TARGET_DATA WHERE Depth > 10.0 AND ? > LastObs AND '
+                    '(ErrAtAriel*24*60 > ? OR ErrAtAriel IS NULL) ORDER BY +rowid', (0, 0))]
+        self.load_telescope_data()
+        for telescope in self.telescope_data:
+            queries.append(('SELECT * FROM "' + telescope.name + '" WHERE ObsCenter BETWEEN ? AND ? ORDER BY rowid',
+                            (date, date)))
 
+        scans = []
+        for query, parameters in queries:
+            for row in self.cursor.execute('EXPLAIN QUERY PLAN ' + query, parameters).fetchall():
+                if row[-1].startswith('SCAN'):
+                    scans.append((query, row[-1]))
+        return scans
 
+    def build_night_table(self, start, end, cache_dir=None):
+        """
+        Calculate sunset and sunrise for every telescope on every date of the simulation and store in Database object,
+        and set up target rise and set for every deep target, calculated only for the dates of forecast transits
+        :param start: First date of simulation: datetime
+        :param end: Last date of simulation: datetime
+        :param cache_dir: Folder of night windows shared between simulations, None to calculate in memory: str
+        """
+        import observation_tools
+        self.load_telescope_data()
+        self.night_table = observation_tools.NightTable(self.telescope_data, start, end, cache_dir=cache_dir)
+        print('Night windows calculated for '+str(self.night_table.days)+' dates')
+        self.target_table = observation_tools.TargetTable(*self.read_deep_targets(), self.telescope_data)
 
+    def read_deep_targets(self):
+        """
+        Read coordinates of every target deep enough to be forecast
+        :return names: Names of targets: list of str
+        :return ras: Right ascension of each target: list of floats
+        :return decs: Declination of each target: list of floats
+        """
+        rows = self.cursor.execute('SELECT Name, RA, Dec FROM TARGET_DATA WHERE Depth > 10.0 ORDER BY Name').fetchall()
+        return [row[0] for row in rows], [row[1] for row in rows], [row[2] for row in rows]
 
+    def increment_total_night(self, start, interval):
+        """
+        Keep a running total of the total available observing hours through out simulation from the night windows of
+        each day in specified window
+        :param start: Start of window: datetime
+        :param interval: Length of window: datetime
+        """
+        import observation_tools
 
+        night_table = self.night_table
+        if night_table is None:
+            night_table = observation_tools.NightTable(self.telescope_data, start, start + interval)
+        self.total_night += night_table.total_night(start, start + interval)
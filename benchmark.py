@@ -0,0 +1,413 @@
+#################################################################
+# Code to benchmark the hot paths of the simulator offline      #
+# Times the astronomy, visibility, scheduling and fitting       #
+# functions, and an end to end run of a small synthetic network #
+# over one simulated year                                       #
+# Saves results as a json baseline, and compares against an     #
+# earlier baseline to check the effect of any optimisation      #
+#################################################################
+
+# network used for every benchmark, Name, Lat, Lon, Alt, Aperture
+TELESCOPES = [['LaPalma', 28.76, 17.88, 2396, 1], ['Siding', -31.27, -149.06, 1165, 1],
+              ['Chile', -30.17, 70.8, 2200, 1]]
+
+
+def parse_arguments():
+    """
+    Allows arguments to be parsed when this method is called. These arguments specify the benchmarks to run
+    :return: args: all parsed arguments
+    """
+    import argparse
+    parser = argparse.ArgumentParser(description='Benchmark the simulator')
+    parser.add_argument('--save', type=str, default='benchmark.json', help='json file to save results to')
+    parser.add_argument('--compare', type=str, default=None, help='json file of an earlier baseline to compare with')
+    parser.add_argument('--only', type=str, nargs='+', default=None, help='Benchmarks to run, default all')
+    parser.add_argument('--repeats', type=int, default=5, help='Number of timed repeats of each benchmark')
+    parser.add_argument('--e2e-repeats', type=int, default=1, help='Number of timed repeats of the end to end run')
+    parser.add_argument('--targets', type=int, default=50, help='Number of synthetic targets in the end to end run')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for synthetic data and observation outcomes')
+    return parser.parse_args()
+
+
+def time_call(func, repeats, number=1, setup=None):
+    """
+    Time repeated calls of a function, after one untimed call to warm up
+    :param func: Function to time, called with no arguments
+    :param repeats: Number of timed repeats: int
+    :param number: Number of calls of func made by one repeat, to give the time per call: int
+    :param setup: Function called before each repeat, not timed, None for no setup
+    :return: Best, median and mean seconds per call, and the repeats and number used: dict
+    """
+    import time
+    import numpy as np
+    if setup is not None:
+        setup()
+    func()
+    times = []
+    for _ in range(repeats):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - start) / number)
+    return {'Best': min(times), 'Median': float(np.median(times)), 'Mean': float(np.mean(times)), 'Repeats': repeats,
+            'Number': number}
+
+
+def make_telescopes(telescope_file):
+    """
+    Write the benchmark network to a telescope csv file
+    :param telescope_file: Location of file: str
+    :return: List of Telescope objects for the network
+    """
+    import observation_tools
+    import synthetic_generator
+    synthetic_generator.write_telescope_csv(TELESCOPES, telescope_file)
+    telescopes = []
+    for row in TELESCOPES:
+        telescope = observation_tools.Telescope()
+        telescope.gen_from_database(row)
+        telescopes.append(telescope)
+    return telescopes
+
+
+def make_clean_database(database_name, targets, start, seed=0):
+    """
+    Generate a clean database of synthetic targets with fitted periods and a forecast of transits from a start date
+    :param database_name: Location of database file: str
+    :param targets: Number of targets: int
+    :param start: Date of first forecast, and so of the start of a simulation: datetime
+    :param seed: Seed for the synthetic data: int
+    """
+    import os
+    import contextlib
+    import numpy as np
+    import synthetic_generator
+    catalog_file = os.path.join(os.path.dirname(database_name), 'catalog.csv')
+    target_rows, observations = synthetic_generator.generate_targets(np.random.default_rng(seed), targets)
+    synthetic_generator.write_catalog_csv(target_rows, catalog_file)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        synthetic_generator.build_clean_database(database_name, catalog_file, observations, start)
+
+
+def bench_astronomy(context):
+    """
+    Time single sun and target rise/set calculations over a year of dates
+    :param context: Settings and synthetic data shared by the benchmarks: dict
+    :return: Results of each benchmark: dict
+    """
+    import mini_staralt
+    from datetime import datetime, timedelta
+    dates = [datetime(2029, 6, 12) + timedelta(days=day) for day in range(365)]
+    lat, lon = TELESCOPES[0][1], TELESCOPES[0][2]
+
+    def sun():
+        for date in dates:
+            mini_staralt.sun_set_rise(date, lon, lat, -12)
+
+    def target():
+        for date in dates:
+            try:
+                mini_staralt.target_rise_set(date, 150.0, 20.0, lon, lat, 20)
+            except (mini_staralt.NeverVisibleError, mini_staralt.AlwaysVisibleError):
+                pass
+
+    return {'sun_set_rise': time_call(sun, context['repeats'], len(dates)),
+            'target_rise_set': time_call(target, context['repeats'], len(dates))}
+
+
+def bench_visibility(context):
+    """
+    Time visibility checks of single transits, from anywhere on Earth and from the benchmark network
+    :param context: Settings and synthetic data shared by the benchmarks: dict
+    :return: Results of each benchmark: dict
+    """
+    import sqlite3
+    import observation_tools
+    from datetime import datetime, timedelta
+    rng = context['rng']
+    transits2 = []
+    for i in range(100):
+        center = datetime(2029, 6, 12) + timedelta(days=float(rng.uniform(0, 365)))
+        transits2.append(observation_tools.Transit2(center, timedelta(minutes=float(rng.uniform(60, 240))),
+                                                    rng.uniform(0, 360), rng.uniform(-60, 60), 3.0, 1.0,
+                                                    str(1000 + i) + 'b', i, 0.001))
+
+    db = sqlite3.connect(context['clean_database'])
+    rows = db.execute('SELECT * FROM DEEP_TRANSITS ORDER BY rowid LIMIT 100').fetchall()
+    db.close()
+    transits = []
+    for row in rows:
+        transit = observation_tools.Transit()
+        transit.gen_from_database(row)
+        transits.append(transit)
+    telescopes = context['telescopes']
+    start = datetime(2029, 6, 11)
+    night_table = observation_tools.NightTable(telescopes, start, start + timedelta(days=60))
+    names = sorted(set(transit.name for transit in transits))
+    positions = {transit.name: (transit.ra, transit.dec) for transit in transits}
+    target_table = observation_tools.TargetTable(names, [positions[name][0] for name in names],
+                                                 [positions[name][1] for name in names], telescopes)
+
+    def general():
+        for transit in transits2:
+            transit.check_visibility_general()
+
+    def telescopes_direct():
+        for transit in transits:
+            transit.telescope = []
+            transit.check_visibility_telescopes(telescopes)
+
+    def clear_target_table():
+        target_table.events = {}
+
+    def telescopes_tables():
+        target_table.prepare(transits)  # target windows for all transits at once, as in obtain_upcoming_transits
+        for transit in transits:
+            transit.telescope = []
+            transit.check_visibility_telescopes(telescopes, night_table, target_table)
+
+    return {'check_visibility_general': time_call(general, context['repeats'], len(transits2)),
+            'check_visibility_telescopes': time_call(telescopes_direct, context['repeats'], len(transits)),
+            'check_visibility_telescopes_tables': time_call(telescopes_tables, context['repeats'], len(transits),
+                                                                  clear_target_table)}
+
+
+def bench_schedule(context):
+    """
+    Time scheduling a week of transits on one telescope with increasing numbers of observations already scheduled
+    :param context: Settings and synthetic data shared by the benchmarks: dict
+    :return: Results of each benchmark: dict
+    """
+    import os
+    import copy
+    import shutil
+    import contextlib
+    import numpy as np
+    import actions
+    import observation_tools
+    import run_sim
+    from datetime import datetime, timedelta
+    rng = context['rng']
+    week = datetime(2029, 6, 12)
+
+    def make_transit(center, number):
+        transit = observation_tools.Transit()
+        duration = timedelta(minutes=float(rng.uniform(60, 240)))
+        transit.name = str(1000 + number % 50) + 'b'
+        transit.ra, transit.dec, transit.epoch = float(rng.uniform(0, 360)), float(rng.uniform(-60, 60)), number
+        transit.center = center
+        transit.ingress = center - duration / 2
+        transit.egress = center + duration / 2
+        transit.duration = duration
+        return transit
+
+    # one week of transits to schedule, spread evenly through the week
+    transits = [make_transit(week + timedelta(hours=float(hour)), i) for i, hour in
+                enumerate(np.sort(rng.uniform(0, 7 * 24, size=50)))]
+
+    results = {}
+    for size in [10, 100, 1000, 10000]:
+        database_name = os.path.join(context['work_dir'], 'schedule_' + str(size) + '.db')
+        shutil.copyfile(context['clean_database'], database_name)
+        database = actions.Database(database_name, context['telescope_file'], 'unlimited', 3)
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            run_sim.populate_telescopes(database)
+        telescope = TELESCOPES[0][0]
+        # existing observations every 12 hours in the years before the week being scheduled
+        for i in range(size):
+            database.schedule([make_transit(week - timedelta(hours=12 * (i + 1)), i)], np.inf, telescope)
+        database.db.commit()
+        index = database.load_schedule_index(telescope)
+
+        def setup():
+            database.db.rollback()
+            database.schedule_index[telescope] = copy.deepcopy(index)
+
+        def run():
+            database.schedule(transits, np.inf, telescope)
+
+        results['schedule_' + str(size)] = time_call(run, context['repeats'], 1, setup)
+        database.db.rollback()
+        database.db.close()
+    return results
+
+
+def bench_fitting(context):
+    """
+    Time period fits with increasing numbers of observations, the batch fit of every target made at the start of a
+    simulation, the running fit updated after each simulated observation, and propagation of timing errors to ARIEL
+    launch
+    :param context: Settings and synthetic data shared by the benchmarks: dict
+    :return: Results of each benchmark: dict
+    """
+    import copy
+    import numpy as np
+    import data_tools
+    rng = context['rng']
+    results = {}
+    for size in [10, 100, 1000]:
+        epochs = np.sort(rng.choice(5000, size=size, replace=False))
+        observations = [data_tools.Observation((float(epoch), 57000.0 + 3.0 * epoch + rng.normal(0, 1e-3),
+                                                float(rng.uniform(3e-4, 2e-3)))) for epoch in epochs]
+        results['period_fit_' + str(size)] = time_call(lambda: data_tools.period_fit(observations), context['repeats'],
+                                                       1)
+
+        # one new observation after the existing ones, as recalculate does after each simulated observation
+        fit = data_tools.EphemerisFit(3.0)
+        fit.add_observations(observations)
+        new_epoch = float(epochs[-1] + 1)
+        new_tmid = 57000.0 + 3.0 * new_epoch + rng.normal(0, 1e-3)
+        running = []
+
+        def setup():
+            running[:] = [copy.deepcopy(fit)]
+
+        def update():
+            running[0].add(new_epoch, new_tmid, 1e-3)
+            running[0].result()
+
+        results['ephemeris_fit_' + str(size)] = time_call(update, context['repeats'], 1, setup)
+
+    # initial fit of 1000 targets with up to 10 observations each, as made before a simulation
+    targets = 1000
+    counts = rng.integers(0, 11, targets)
+    index = np.repeat(np.arange(targets), counts)
+    epochs = np.concatenate([-np.sort(rng.choice(500, size=count, replace=False)) for count in counts])
+    periods = rng.uniform(0.7, 6.0, targets)
+    tmid_errs = rng.uniform(3e-4, 2e-3, len(index))
+    tmids = 57000.0 + periods[index] * epochs + rng.normal(0, tmid_errs)
+    results['period_fit_batch'] = time_call(lambda: data_tools.period_fit_batch(index, epochs.astype(float), tmids,
+                                                                                tmid_errs, targets),
+                                            context['repeats'], targets)
+
+    rows = [['1000b', rng.uniform(0.7, 6.0), 1e-5, rng.uniform(56000, 58000), 1e-3, rng.uniform(60, 240)]
+            for _ in range(100)]
+
+    def prop():
+        for row in rows:
+            data_tools.prop_forwards(row)
+
+    results['prop_forwards'] = time_call(prop, context['repeats'], len(rows))
+    return results
+
+
+def bench_end_to_end(context):
+    """
+    Time a full simulation of the benchmark network over one simulated year
+    :param context: Settings and synthetic data shared by the benchmarks: dict
+    :return: Results of each benchmark: dict
+    """
+    import os
+    import shutil
+    import contextlib
+    import run_sim
+    base_dir = os.path.join(context['work_dir'], 'end_to_end')
+    os.makedirs(os.path.join(base_dir, 'clean'), exist_ok=True)
+    os.makedirs(os.path.join(base_dir, 'telescopes'), exist_ok=True)
+    shutil.copyfile(context['clean_database'], os.path.join(base_dir, 'clean', 'clean3.db'))
+    shutil.copyfile(context['telescope_file'], os.path.join(base_dir, 'telescopes', 'benchmark.csv'))
+    outcome = []
+
+    def run():
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            counts, totals, dates = run_sim.main(['3', 'benchmark.csv', '2perweek', '--base-dir', base_dir,
+                                                  '--seed', str(context['seed'])])
+        outcome[:] = [counts[-1], totals[-1]]
+
+    result = time_call(run, context['e2e_repeats'], 1)
+    result['Constrained'], result['Targets'] = int(outcome[0]), int(outcome[1])  # changes if results change
+    return {'end_to_end': result}
+
+
+# benchmarks in the order they run
+BENCHMARKS = {'astronomy': bench_astronomy, 'visibility': bench_visibility, 'schedule': bench_schedule,
+              'fitting': bench_fitting, 'end_to_end': bench_end_to_end}
+
+
+def machine_info():
+    """
+    Describe the machine and versions a baseline was made with
+    :return: dict
+    """
+    import os
+    import sys
+    import platform
+    import numpy as np
+    from datetime import datetime
+    return {'Created': datetime.now().isoformat(timespec='seconds'), 'Platform': platform.platform(),
+            'Processor': platform.processor(), 'CPUs': os.cpu_count(), 'Python': sys.version.split()[0],
+            'NumPy': np.__version__}
+
+
+def run_benchmarks(names, repeats=5, e2e_repeats=1, targets=50, seed=0):
+    """
+    Run benchmarks in a temporary folder of synthetic data
+    :param names: Names of benchmarks to run, from BENCHMARKS: list of str
+    :param repeats: Number of timed repeats of each benchmark: int
+    :param e2e_repeats: Number of timed repeats of the end to end run: int
+    :param targets: Number of synthetic targets: int
+    :param seed: Seed for synthetic data and observation outcomes: int
+    :return: Results of each benchmark, keyed by name: dict
+    """
+    import os
+    import tempfile
+    import numpy as np
+    from datetime import datetime
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        telescope_file = os.path.join(work_dir, 'benchmark.csv')
+        clean_database = os.path.join(work_dir, 'clean.db')
+        context = {'work_dir': work_dir, 'repeats': repeats, 'e2e_repeats': e2e_repeats, 'seed': seed,
+                   'telescope_file': telescope_file,
+                   'telescopes': make_telescopes(telescope_file), 'clean_database': clean_database}
+        # one year before ARIEL launch, the end of every simulation
+        make_clean_database(clean_database, targets, datetime(2029, 6, 12), seed)
+        for name in names:
+            print('Running ' + name + ' benchmarks')
+            context['rng'] = np.random.default_rng(seed)  # same data whichever benchmarks run
+            for key, result in BENCHMARKS[name](context).items():
+                print('  ' + key.ljust(36) + format(result['Best'] * 1000, '12.4f') + 'ms')
+                results[key] = result
+    return results
+
+
+def compare(results, baseline):
+    """
+    Print the change in best time of each benchmark from a baseline
+    :param results: Results of each benchmark, keyed by name: dict
+    :param baseline: Saved baseline, as written by main: dict
+    """
+    print('Compared with baseline from ' + baseline['Machine']['Created'] + ':')
+    for key, result in results.items():
+        if key not in baseline['Results']:
+            continue
+        old = baseline['Results'][key]['Best']
+        ratio = old / result['Best'] if result['Best'] > 0 else float('inf')
+        line = '  ' + key.ljust(36) + format(old * 1000, '12.4f') + 'ms ->' + format(result['Best'] * 1000, '12.4f') + \
+               'ms ' + format(ratio, '8.2f') + 'x speedup'
+        if 'Constrained' in result and (result['Constrained'], result['Targets']) != \
+                (baseline['Results'][key].get('Constrained'), baseline['Results'][key].get('Targets')):
+            line += ', RESULTS DIFFER'
+        print(line)
+
+
+def main():
+    import json
+    args = parse_arguments()
+    names = args.only if args.only is not None else list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            raise ValueError('Unknown benchmark ' + name + ', choose from ' + ', '.join(BENCHMARKS))
+    results = run_benchmarks(names, args.repeats, args.e2e_repeats, args.targets, args.seed)
+    with open(args.save, 'w') as f:
+        json.dump({'Machine': machine_info(), 'Settings': {'Repeats': args.repeats, 'Targets': args.targets,
+                                                           'Seed': args.seed}, 'Results': results}, f, indent=1)
+    print('Results saved to ' + args.save)
+    if args.compare is not None:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
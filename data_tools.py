@@ -8,6 +8,41 @@
 #################################################################
 
 
+def create_obs_table(cursor):
+    """
+    Create table holding the observations of all targets, indexed by target and epoch, if it does not exist
+    :param cursor: Cursor connected to database: cursor
+    """
+    cursor.execute('CREATE TABLE IF NOT EXISTS OBSERVATIONS(Target VARCHAR(25), ObID REAL, Epoch REAL, ObsCenter DECIMAL(1'
+                   '6,8), ObsCenterErr DECIMAL(16,8), TrueCenter DECIMAL(16,8), TrueCenterErr DECIMAL(16,8), ObsDepth DEC'
+                   'IMAL(16,8), ObsDepthErr DECIMAL(16,8), ObsDuration DECIMAL(16,8), ObsDurationErr DECIMAL(16,8), Sourc'
+                   'e VARCHAR(25), UNIQUE(Target, ObsCenter))')
+    cursor.execute('CREATE INDEX IF NOT EXISTS OBSERVATIONS_TARGET_EPOCH ON OBSERVATIONS(Target, Epoch)')
+
+
+def insert_observation(cursor, name, values):
+    """
+    Add a single observation for a target, raises sqlite3.IntegrityError if the transit center is already stored
+    :param cursor: Cursor connected to database: cursor
+    :param name: Target observed: str
+    :param values: Values for each column of OBSERVATIONS, None or 'NULL' for NULL: dict
+    """
+    columns = ['Target'] + list(values)
+    row = [name] + [None if isinstance(value, str) and value == 'NULL' else value for value in values.values()]
+    cursor.execute('INSERT INTO OBSERVATIONS (' + ', '.join(columns) + ') VALUES (' +
+                   ', '.join(['?'] * len(columns)) + ')', row)
+
+
+def read_obs_ids(cursor, name):
+    """
+    Read observation IDs for a given target
+    :param cursor: Cursor connected to database: cursor
+    :param name: Target to be queried: str
+    :return: List of ID tuples
+    """
+    return cursor.execute('SELECT ObID FROM OBSERVATIONS WHERE Target = ?', (name,)).fetchall()
+
+
 def read_obs_data(cursor, name):
     """
     Read all observations for a given target and store as a list of Observation objects
@@ -16,7 +51,7 @@ def read_obs_data(cursor, name):
     :return: List of Observation objects
     """
     # obtain observation data
-    cursor.execute('SELECT Epoch, ObsCenter, ObsCenterErr FROM \''+name+'\'')
+    cursor.execute('SELECT Epoch, ObsCenter, ObsCenterErr FROM OBSERVATIONS WHERE Target = ? ORDER BY rowid', (name,))
     rows = cursor.fetchall()
     observations = []
     # loop though observations
@@ -28,6 +63,243 @@ def read_obs_data(cursor, name):
     return observations
 
 
+def read_obs_arrays(cursor, names):
+    """
+    Read all observations for many targets and store as flat arrays, with the position of each target in names
+    :param cursor: Cursor connected to database: cursor
+    :param names: Targets to be queried: list of str
+    :return index: Position in names of the target for each observation: array of ints
+    :return epochs: Epoch of each observation: array of floats
+    :return tmids: Transit center of each observation: array of floats
+    :return tmid_errs: Error in transit center of each observation: array of floats
+    """
+    import numpy as np
+    positions = dict(zip(names, range(len(names))))
+    # obtain complete observation data for all targets at once
+    rows = cursor.execute('SELECT Target, Epoch, ObsCenter, ObsCenterErr FROM OBSERVATIONS WHERE Epoch NOT NULL AND '
+                          'ObsCenter NOT NULL AND ObsCenterErr NOT NULL ORDER BY rowid').fetchall()
+    rows = [row for row in rows if row[0] in positions]
+    index = np.array([positions[row[0]] for row in rows], dtype=int)
+    data = np.array([row[1:] for row in rows], dtype=float).reshape(-1, 3)
+    return index, data[:, 0], data[:, 1], data[:, 2]
+
+
+def read_time_format(cursor):
+    """
+    Find how times are stored in DEEP_TRANSITS and the schedule tables of a database
+    :param cursor: Cursor connected to database: cursor
+    :return: 'text' for datetime strings, 'jd' for JD - 2400000, or 'seconds' for seconds since 1970: str
+    """
+    import sqlite3
+    try:
+        row = cursor.execute('SELECT Value FROM SETTINGS WHERE Name = "TimeFormat"').fetchone()
+    except sqlite3.OperationalError:
+        return 'text'  # databases made before the setting existed
+    if row is None:
+        return 'text'
+    return row[0]
+
+
+def set_time_format(cursor, time_format):
+    """
+    Record how times are stored in a database, without converting any stored values
+    :param cursor: Cursor connected to database: cursor
+    :param time_format: 'text', 'jd' or 'seconds': str
+    """
+    time_units(time_format)  # check format is known
+    cursor.execute('CREATE TABLE IF NOT EXISTS SETTINGS(Name VARCHAR(25), Value VARCHAR(25), UNIQUE(Name))')
+    cursor.execute('INSERT OR REPLACE INTO SETTINGS VALUES ("TimeFormat", ?)', (time_format,))
+
+
+def write_checkpoint(cursor, sim_date, state):
+    """
+    Store the state of a simulation loop, in the same transaction as the changes it describes
+    :param cursor: Cursor connected to database: cursor
+    :param sim_date: Simulated date of the checkpoint: datetime
+    :param state: State of the simulation, made only of values json can store: dict
+    """
+    import json
+    cursor.execute('CREATE TABLE IF NOT EXISTS CHECKPOINTS(SimDate DATETIME, State TEXT)')
+    cursor.execute('INSERT INTO CHECKPOINTS VALUES (?, ?)', (str(sim_date), json.dumps(state)))
+
+
+def read_checkpoint(cursor):
+    """
+    Obtain the latest state of a simulation loop stored in a database
+    :param cursor: Cursor connected to database: cursor
+    :return: State of the simulation, None if no checkpoint has been stored: dict
+    """
+    import json
+    import sqlite3
+    try:
+        row = cursor.execute('SELECT State FROM CHECKPOINTS ORDER BY rowid DESC LIMIT 1').fetchone()
+    except sqlite3.OperationalError:
+        return None  # simulation has not reached a checkpoint
+    if row is None:
+        return None
+    return json.loads(row[0])
+
+
+def time_units(time_format):
+    """
+    Zero point and unit of a stored time format
+    :param time_format: 'text', 'jd' or 'seconds': str
+    :return zero: Time stored as 0, None for text: datetime
+    :return unit: Time stored as 1 after zero, None for text: timedelta
+    """
+    from datetime import datetime, timedelta
+    if time_format == 'text':
+        return None, None
+    elif time_format == 'jd':
+        return datetime(1858, 11, 16, 12), timedelta(days=1)
+    elif time_format == 'seconds':
+        return datetime(1970, 1, 1), timedelta(seconds=1)
+    raise ValueError('Unknown time format ' + str(time_format))
+
+
+def time_to_value(time, time_format):
+    """
+    Convert time to the value stored in the database
+    :param time: Time to store: datetime
+    :param time_format: 'text', 'jd' or 'seconds': str
+    :return: Stored value: str or float
+    """
+    zero, unit = time_units(time_format)
+    if zero is None:
+        return str(time)
+    return (time - zero) / unit
+
+
+def value_to_time(value, time_format):
+    """
+    Convert value stored in the database to a time, reading both text formats written by str(datetime)
+    :param value: Stored value: str or float
+    :param time_format: 'text', 'jd' or 'seconds': str
+    :return: Time: datetime
+    """
+    from datetime import datetime
+    zero, unit = time_units(time_format)
+    if zero is None:
+        return datetime.fromisoformat(value)
+    return zero + value * unit
+
+
+def duration_to_value(duration, time_format):
+    """
+    Convert duration to the value stored in the database, in days for 'jd' and seconds for 'seconds'
+    :param duration: Duration to store: timedelta
+    :param time_format: 'text', 'jd' or 'seconds': str
+    :return: Stored value: str or float
+    """
+    zero, unit = time_units(time_format)
+    if zero is None:
+        return str(duration)
+    return duration / unit
+
+
+def value_to_duration(value, time_format):
+    """
+    Convert value stored in the database to a duration, reading the text format written by str(timedelta)
+    :param value: Stored value: str or float
+    :param time_format: 'text', 'jd' or 'seconds': str
+    :return: Duration: timedelta
+    """
+    from datetime import timedelta
+    zero, unit = time_units(time_format)
+    if zero is not None:
+        return value * unit
+    days = 0
+    if ',' in value:
+        day_part, value = value.split(',')
+        days = int(day_part.split()[0])
+    time_split = value.split(':')
+    return timedelta(days=days, hours=float(time_split[0]), minutes=float(time_split[1]),
+                     seconds=float(time_split[2]))
+
+
+def value_to_day_hours(values, time_format):
+    """
+    Find midnight before the first of a set of stored times, and each time in hours after that midnight, building
+    only the datetime for midnight when times are stored as numbers
+    :param values: Stored values: list of str or floats
+    :param time_format: 'text', 'jd' or 'seconds': str
+    :return midnight: Midnight before the first time: datetime
+    :return hours: Each time in hours after midnight: list of floats
+    """
+    import math
+    from datetime import datetime, timedelta
+    zero, unit = time_units(time_format)
+    if zero is None:
+        times = [datetime.fromisoformat(value) for value in values]
+        midnight = times[0].replace(hour=0, minute=0, second=0, microsecond=0)
+        return midnight, [(time - midnight).total_seconds() / 3600 for time in times]
+
+    # convert to days since 1970, which starts at midnight
+    scale = unit / timedelta(days=1)
+    offset = (zero - datetime(1970, 1, 1)) / timedelta(days=1)
+    days = [value * scale + offset for value in values]
+    day = math.floor(days[0])
+    return datetime(1970, 1, 1) + timedelta(days=day), [(value - day) * 24 for value in days]
+
+
+def period_fit_batch(index, epochs, tmids, tmid_errs, count):
+    """
+    Performs a weighted linear fit of transit center against epoch for many targets at once, equivalent to
+    period_fit for each target
+    :param index: Target of each observation, from 0 to count-1: array of ints
+    :param epochs: Epoch of each observation: array of floats
+    :param tmids: Transit center of each observation: array of floats
+    :param tmid_errs: Error in transit center of each observation: array of floats
+    :param count: Number of targets: int
+    :return fit_period: Resulting period from fit, per target: array of floats
+    :return fit_period_err: Error in resulting period from fit, per target: array of floats
+    :return tmid_max: Latest tmid in observations, per target: array of floats
+    :return tmid_max_err: Error in latest tmid in observations, per target: array of floats
+    :return epoch_max: Latest epoch in observations, per target: array of floats
+    :return fitted: Whether each target had enough observations for a fit: array of booleans
+    """
+    import numpy as np
+    index = np.asarray(index, dtype=int)
+    epochs = np.asarray(epochs, dtype=float)
+    tmids = np.asarray(tmids, dtype=float)
+    tmid_errs = np.asarray(tmid_errs, dtype=float)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # statistical weights as in Observation, polyfit weights residuals so the sums use their squares
+        weights = np.where(tmid_errs != 0, 1 / np.where(tmid_errs != 0, tmid_errs, 1), 0)
+        w2 = weights * weights
+
+        # weighted means per target, the fit is made about these to avoid cancellation in the sums
+        n = np.bincount(index, minlength=count)
+        sum_w = np.bincount(index, weights=w2, minlength=count)
+        mean_epoch = np.bincount(index, weights=w2 * epochs, minlength=count) / sum_w
+        mean_tmid = np.bincount(index, weights=w2 * tmids, minlength=count) / sum_w
+        d_epoch = epochs - mean_epoch[index]
+        d_tmid = tmids - mean_tmid[index]
+        s_ee = np.bincount(index, weights=w2 * d_epoch * d_epoch, minlength=count)
+        s_et = np.bincount(index, weights=w2 * d_epoch * d_tmid, minlength=count)
+
+        # slope and its covariance, scaled by the residuals as in np.polyfit(cov=True)
+        fit_period = s_et / s_ee
+        residuals = np.bincount(index, weights=w2 * (d_tmid - fit_period[index] * d_epoch) ** 2, minlength=count)
+        fit_period_err = np.sqrt(residuals / (n - 2) / s_ee)
+
+    fitted = (n >= 3) & np.isfinite(fit_period) & np.isfinite(fit_period_err)
+
+    # latest tmid w/error, the first of any equal values, and latest epoch
+    tmid_max = np.zeros(count)
+    tmid_max_err = np.zeros(count)
+    order = np.lexsort((np.arange(len(tmids)), -tmids, index))
+    first = order[np.r_[True, index[order][1:] != index[order][:-1]]] if len(order) != 0 else order
+    latest = first[tmids[first] > 0]
+    tmid_max[index[latest]] = tmids[latest]
+    tmid_max_err[index[latest]] = tmid_errs[latest]
+    epoch_max = np.full(count, np.nan)
+    np.fmax.at(epoch_max, index, epochs)
+
+    return fit_period, fit_period_err, tmid_max, tmid_max_err, epoch_max, fitted
+
+
 def period_fit(observations):
     """
     Performs a fit period for a given set of observations of a target
@@ -83,6 +355,106 @@ def period_fit(observations):
         pass
 
 
+class EphemerisFit:
+    """
+    EphemerisFit object, keeps running weighted sums for the period fit of a single target
+    Observations are added one at a time, and the fit matches period_fit on the same observations without refitting
+    """
+    def __init__(self, reference_period=0.0):
+        """
+        Constructor for a target with no observations
+        :param reference_period: Approximate period of the target, transit centers are stored relative to this
+        ephemeris so the sums stay small and the period error does not lose precision: float
+        """
+        self.reference_period = reference_period
+        self.reference_epoch = None
+        self.reference_tmid = None
+        self.count = 0
+        # weighted sums, as running means and co-moments about the means
+        self.sum_w = 0.0
+        self.mean_epoch = 0.0
+        self.mean_tmid = 0.0
+        self.s_ee = 0.0
+        self.s_et = 0.0
+        self.s_tt = 0.0
+        # latest values
+        self.tmid_max = 0
+        self.tmid_max_err = 0
+        self.epoch_max = None
+
+    def add(self, epoch, tmid, tmid_err):
+        """
+        Add a single observation to the fit
+        :param epoch: Epoch of observation: int
+        :param tmid: Observed transit center: float
+        :param tmid_err: Error in observed transit center: float
+        """
+        if self.reference_epoch is None:
+            self.reference_epoch = epoch
+            self.reference_tmid = tmid
+        self.count += 1
+
+        # check and set latest tmid w/error, and latest epoch
+        if tmid > self.tmid_max:
+            self.tmid_max = tmid
+            self.tmid_max_err = tmid_err
+        if self.epoch_max is None or epoch > self.epoch_max:
+            self.epoch_max = epoch
+
+        # statistical weight as in Observation, squared as np.polyfit weights the residuals
+        try:
+            weight = 1 / tmid_err
+        except ZeroDivisionError:
+            weight = 0
+        w2 = weight * weight
+        if w2 == 0:
+            return
+
+        # update means and co-moments relative to the reference ephemeris
+        x = epoch - self.reference_epoch
+        y = tmid - self.reference_tmid - self.reference_period * x
+        self.sum_w += w2
+        dx = x - self.mean_epoch
+        dy = y - self.mean_tmid
+        self.mean_epoch += w2 * dx / self.sum_w
+        self.mean_tmid += w2 * dy / self.sum_w
+        self.s_ee += w2 * dx * (x - self.mean_epoch)
+        self.s_et += w2 * dx * (y - self.mean_tmid)
+        self.s_tt += w2 * dy * (y - self.mean_tmid)
+
+    def add_observations(self, observations):
+        """
+        Add a list of observations to the fit
+        :param observations: List of Observation objects
+        """
+        for ob in observations:
+            self.add(ob.epoch, ob.tmid, ob.tmid_err)
+
+    def result(self):
+        """
+        Current result of the fit, as period_fit
+        :return fit_period: Resulting period from fit: float
+        :return fit_period_err: Error in resulting period from fit: float
+        :return tmid_max: Latest tmid in set of observations: float
+        :return tmid_max_err: Error in latest tmid in set of observations: float
+        :return epoch_max: Transit epoch for the latest tmid in sample
+        """
+        import numpy as np
+        # check for sufficient values
+        if self.count < 3:
+            # if insufficient observations, raise warning
+            raise Warning
+        if self.s_ee <= 0:
+            return None
+
+        slope = self.s_et / self.s_ee
+        residuals = max(self.s_tt - slope * self.s_et, 0.0)
+        fit_period = self.reference_period + slope
+        fit_period_err = np.sqrt(residuals / (self.count - 2) / self.s_ee)  # calculate error
+
+        return fit_period, fit_period_err, self.tmid_max, self.tmid_max_err, self.epoch_max
+
+
 def check_better_period(start, fit, fit_err):
     dif = abs(start - fit)
     if fit_err < dif:
@@ -113,53 +485,109 @@ class Observation:
         return str(self.epoch)+' '+str(self.tmid)
 
 
+def ariel_launch_jd():
+    """
+    Date of ARIEL launch in the JD format used in the database, calculated once
+    :return: JD - 2400000: float
+    """
+    global _ariel_jd
+    if _ariel_jd is None:
+        import datetime
+        import julian
+        ariel = datetime.datetime(year=2029, month=6, day=12, hour=0, minute=0, second=0)
+        _ariel_jd = julian.to_jd(ariel, fmt='jd') - 2400000
+    return _ariel_jd
+
+
+_ariel_jd = None
+
+
+def count_epochs(tmid, period, end):
+    """
+    Count the periods needed to step from a transit center to a date, one period at a time
+    :param tmid: Transit center: float
+    :param period: Period: float
+    :param end: Date to reach: float
+    :return: Number of periods, at least one: int
+    """
+    count = 0
+    current = tmid
+    while current < end:  # loop towards it
+        count += 1  # count epochs
+        current += period  # increment date by period
+    return count
+
+
+def prop_forwards_batch(period, period_err, tmid, tmid_err, duration):
+    """
+    Calculate the propagated uncertainty at ARIEL launch for many targets at once
+    :param period: Current periods: array of floats
+    :param period_err: Errors in current periods, NaN or None if missing: array of floats
+    :param tmid: Latest transit centers: array of floats
+    :param tmid_err: Errors in latest transit centers, NaN or None if missing: array of floats
+    :param duration: Transit durations in minutes: array of floats
+    :return err_tot: Propagated errors, NaN if data missing: array of floats
+    :return percent: Propagated errors as a percentage of duration: array of floats
+    :return loss: Whether each target is lost at launch: array of booleans
+    """
+    import numpy as np
+
+    ariel_jd = ariel_launch_jd()
+    period = np.asarray(period, dtype=float)
+    period_err = np.asarray(period_err, dtype=float)
+    tmid = np.asarray(tmid, dtype=float)
+    tmid_err = np.asarray(tmid_err, dtype=float)
+    duration = np.asarray(duration, dtype=float)
+
+    complete = ~np.isnan(tmid_err) & ~np.isnan(period_err)  # check that all information required is present
+    before = complete & (tmid < ariel_jd)  # check date is before launch
+    if np.any(complete & ~before):
+        print('End of sim reached')
+
+    # count epochs required to reach launch, the first whole period at or after it
+    with np.errstate(divide='ignore', invalid='ignore'):
+        count = np.where(before, np.ceil((ariel_jd - tmid) / period), 0)
+        count = np.where(before & (count < 1), 1, count)
+        # correct for rounding in the division, so tmid + count*period is the first value at or after launch
+        count = np.where(before & (tmid + (count - 1) * period >= ariel_jd), count - 1, count)
+        count = np.where(before & (tmid + count * period < ariel_jd), count + 1, count)
+
+        # tmid + count*period is rounded differently from adding one period at a time, so where either side of the
+        # boundary is within the rounding of that many additions, count by stepping forward as before
+        tol = 2 * (count + 2) * np.spacing(np.maximum(np.abs(tmid), abs(ariel_jd)))
+        near = before & np.isfinite(period) & (period > 0) & (
+            (np.abs(tmid + (count - 1) * period - ariel_jd) <= tol) | (np.abs(tmid + count * period - ariel_jd) <= tol))
+        for i in np.flatnonzero(near):
+            count[i] = count_epochs(float(tmid[i]), float(period[i]), ariel_jd)
+
+        # propagate error by the number of epochs found, or just store current values if after launch
+        err_tot = np.where(before, np.sqrt(tmid_err * tmid_err + count * count * period_err * period_err), tmid_err)
+        err_tot = np.where(complete, err_tot, np.nan)
+        # convert to percentage, if data missing, insert high values
+        percent = np.where(complete, err_tot * 24 * 60 / duration * 100, 1000)
+    # check for total loss
+    loss = percent >= 100.0
+
+    return err_tot, percent, loss
+
+
 def prop_forwards(row):
     """
     Calculate the propagated uncertainty based on the current data available
     :param row: array of data containing the information needed to propagate a timing uncertainty
     :return:
     """
-    import numpy as np
-    import datetime
-    import julian
-
-    # set date of ARIEL launch and convert to JD
-    ariel = datetime.datetime(year=2029, month=6, day=12, hour=0, minute=0, second=0)
-    ariel_jd = julian.to_jd(ariel, fmt='jd') - 2400000
     # extract data
     period = float(row[1])
     period_err = float(row[2])
     tmid = row[3]
     tmid_err = row[4]
     duration = float(row[5])
-    err_tot = 'NULL'
-    current = tmid
-    count = 0  # counter for epochs required
-
-    if tmid_err is not None and period_err is not None:  # check that all information required is present
-        if current < ariel_jd:  # check date is before launch
-            while current < ariel_jd:  # loop towards it
-                count += 1  # count epochs
-                current += period  # increment date by period
-            # propagate error by the number of epochs found and convert to percentage
-            err_tot = np.sqrt(tmid_err * tmid_err + count * count * period_err * period_err)
-            percent = err_tot * 24 * 60 / duration * 100
-            # check for total loss
-            if percent >= 100.0:
-                loss = True
-            else:
-                loss = False
-        else: # if date is after launch, just store current values
-            print('End of sim reached')
-            err_tot = tmid_err
-            percent = err_tot*24*60/duration*100
-            # check for total loss
-            if percent >= 100.0:
-                loss = True
-            else:
-                loss = False
-    else: # if data missing, insert high values
-        percent = 1000
-        loss = True
 
-    return err_tot, percent, loss
+    err_tot, percent, loss = prop_forwards_batch([period], [period_err], [tmid], [tmid_err], [duration])
+    if tmid_err is not None and period_err is not None:
+        err_tot = float(err_tot[0])
+    else:  # if data missing
+        err_tot = 'NULL'
+
+    return err_tot, float(percent[0]), bool(loss[0])
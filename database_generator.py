@@ -126,6 +126,7 @@ def generate_sql_table_from_csv(filename, table_name, cursor):
 
 def main():
     import sqlite3
+    import data_tools
     database_name = 'clean3.db'
     start_file = '../database/realfake_data2.csv'
 
@@ -134,13 +135,8 @@ def main():
     generate_sql_table_from_csv(start_file, 'TARGET_DATA', cursor)
     db.commit()
 
-    cursor.execute('SELECT Name FROM TARGET_DATA')
-    names = cursor.fetchall()
-    for name in names:
-        cursor.execute('CREATE TABLE IF NOT EXISTS \'' + name[
-            0] + '\'(ObID REAL, Epoch REAL, ObsCenter DECIMAL(16,8), ObsCenterErr DECIMAL(16,8), TrueCenter DECIMAL(16,'
-                 '8), TrueCenterErr DECIMAL(16,8), ObsDepth DECIMAL(16,8), ObsDepthErr DECIMAL(16,8), ObsDuration DECIM'
-                 'AL(16,8), ObsDurationErr DECIMAL(16,8), Source VARCHAR(25), UNIQUE(ObsCenter))')
+    # single table for the observations of all targets
+    data_tools.create_obs_table(cursor)
     db.commit()
 
     import actions
@@ -0,0 +1,182 @@
+#################################################################
+# Code to run an ensemble of replicas of a single simulation    #
+# setup, each with its own random stream                        #
+# Runs replicas in a pool of processes and writes the mean and  #
+# percentile bands of the running totals to one csv file        #
+# Stops early once the confidence interval on the final         #
+# constrained fraction is narrower than requested               #
+#################################################################
+
+
+def parse_arguments():
+    """
+    Allows arguments to be parsed when this method is called. These arguments specify the ensemble
+    :return: args: all parsed arguments
+    """
+    import argparse
+    parser = argparse.ArgumentParser(description='Run an ensemble of replicas of one simulation')
+    parser.add_argument('threshold', type=int, help='Accuracy threshold')
+    parser.add_argument('telescopes', type=str, help='file containing telescope data for simulation')
+    parser.add_argument('mode', type=str, help='Operating mode')
+    parser.add_argument('--replicas', type=int, default=20, help='Maximum number of replicas')
+    parser.add_argument('--min-replicas', type=int, default=5, help='Number of replicas before stopping early')
+    parser.add_argument('--ci-width', type=float, default=0.0,
+                        help='Stop once the 95%% confidence interval on the final constrained fraction is narrower '
+                             'than this, 0 to run all replicas')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the ensemble, replica i uses stream i spawned '
+                                                            'from it')
+    parser.add_argument('--percentiles', type=float, nargs='+', default=[5, 50, 95], help='Percentile bands')
+    parser.add_argument('--workers', type=int, default=None, help='Number of processes, default one per core')
+    parser.add_argument('--retries', type=int, default=1, help='Number of times to rerun a failed replica')
+    parser.add_argument('--base-dir', type=str, default='.', help='Folder containing clean/ and telescopes/')
+    parser.add_argument('--sim-args', type=str, nargs='...', default=[],
+                        help='Further options passed to run_sim.py for every replica, e.g. --in-memory')
+    return parser.parse_args()
+
+
+def confidence_width(fractions, z=1.96):
+    """
+    Width of the normal confidence interval on the mean of a set of values
+    :param fractions: Values from each replica: list of floats
+    :param z: Number of standard errors either side of the mean, 1.96 for 95%: float
+    :return: Width of interval, inf for fewer than two values: float
+    """
+    import numpy as np
+    if len(fractions) < 2:
+        return np.inf
+    return 2 * z * np.std(fractions, ddof=1) / np.sqrt(len(fractions))
+
+
+def aggregate(results, percentiles):
+    """
+    Combine running totals from each replica into mean and percentile bands at every forecasting period
+    :param results: (counts, totals, dates) from each replica, all with the same dates: list of tuples
+    :param percentiles: Percentiles to calculate: list of floats
+    :return dates: Dates of every forecasting period
+    :return bands: Dict of arrays for each column of the output, keyed by column name
+    """
+    import numpy as np
+    # replicas can only differ in length if the dates differ, so trim to the shortest
+    length = min(len(result[2]) for result in results)
+    dates = results[0][2][:length]
+    counts = np.array([result[0][:length] for result in results], dtype=float)
+    totals = np.array([result[1][:length] for result in results], dtype=float)
+    fractions = np.divide(counts, totals, out=np.zeros_like(counts), where=totals > 0)
+
+    bands = {'MeanObserved': counts.mean(axis=0), 'MeanTargets': totals.mean(axis=0),
+             'MeanFraction': fractions.mean(axis=0)}
+    for percentile in percentiles:
+        bands['P' + format(percentile, 'g') + 'Fraction'] = np.percentile(fractions, percentile, axis=0)
+    return dates, bands
+
+
+def write_ensemble_results(dates, bands, replicas, outfile):
+    """
+    Write mean and percentile bands for every forecasting period to a csv file
+    :param dates: Dates of every forecasting period
+    :param bands: Dict of arrays for each column, keyed by column name
+    :param replicas: Number of replicas combined: int
+    :param outfile: Location of file: str
+    """
+    names = list(bands)
+    with open(outfile, 'w') as f:
+        f.write('# Replicas: ' + str(replicas) + '\n')
+        f.write('# Date\t' + '\t'.join(names))
+        for i in range(len(dates)):
+            f.write('\n' + str(dates[i]) + '\t' + '\t'.join(format(bands[name][i], '.6g') for name in names))
+
+
+def run_ensemble(threshold, network, mode, replicas, base_dir='.', sim_args=(), seed=0, workers=None, retries=1,
+                 ci_width=0.0, min_replicas=5):
+    """
+    Run replicas of one simulation in a pool of processes, keeping one replica per process queued, until all have
+    run or the confidence interval on the final constrained fraction is narrow enough
+    :param threshold: Accuracy threshold: int
+    :param network: Name of telescope file: str
+    :param mode: Operating mode: str
+    :param replicas: Maximum number of replicas: int
+    :param base_dir: Folder containing clean/ and telescopes/: str
+    :param sim_args: Further options for run_sim.py: list of str
+    :param seed: Seed of the ensemble, each replica using its own spawned stream: int
+    :param workers: Number of processes, None for one per core: int
+    :param retries: Number of times to rerun a failed replica: int
+    :param ci_width: Width of 95% interval to stop at, 0 to run all replicas: float
+    :param min_replicas: Number of finished replicas needed before stopping early: int
+    :return: (counts, totals, dates) from each finished replica, in order of replica: list of tuples
+    """
+    import os
+    import time
+    from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+    import sweep
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, replicas))
+    print('Running up to ' + str(replicas) + ' replicas on ' + str(workers) + ' processes')
+
+    finished = {}
+    fractions = []
+    start = time.time()
+    next_replica = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        running = {}
+        stop = False
+        while True:
+            # keep every process busy until stopping
+            while not stop and next_replica < replicas and len(running) < workers:
+                replica_args = list(sim_args) + ['--seed', str(seed), '--stream', str(next_replica)]
+                future = pool.submit(sweep.run_one, threshold, network, mode, base_dir, replica_args, retries,
+                                     '_r' + str(next_replica))
+                running[future] = next_replica
+                next_replica += 1
+            if len(running) == 0:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                replica = running.pop(future)
+                if future.cancelled():
+                    continue
+                try:
+                    success, result, attempts = future.result()
+                except Exception as e:  # worker process died
+                    success, result, attempts = False, repr(e), 1
+                if not success:
+                    print('Replica ' + str(replica) + ' FAILED after ' + str(attempts) + ' attempts: ' + str(result))
+                    continue
+                finished[replica] = result
+                counts, totals = result[0], result[1]
+                fractions.append(counts[-1] / totals[-1] if totals[-1] > 0 else 0.0)
+                width = confidence_width(fractions)
+                print('[' + str(len(finished)) + ' replicas, ' + str(round(time.time() - start)) + 's] replica ' +
+                      str(replica) + ' constrained ' + str(counts[-1]) + '/' + str(totals[-1]) +
+                      ', final fraction ' + format(sum(fractions) / len(fractions), '.4f') + ' +/- ' +
+                      format(width / 2, '.4f'))
+                if ci_width > 0 and len(finished) >= min_replicas and width < ci_width and not stop:
+                    print('Confidence interval narrower than ' + str(ci_width) + ', stopping')
+                    stop = True
+            if stop:
+                # replicas already running are left to finish, their results are still used
+                for future in running:
+                    future.cancel()
+
+    return [finished[replica] for replica in sorted(finished)]
+
+
+def main():
+    import os
+    import run_sim
+    args = parse_arguments()
+    results = run_ensemble(args.threshold, args.telescopes, args.mode, args.replicas, args.base_dir, args.sim_args,
+                           args.seed, args.workers, args.retries, args.ci_width, args.min_replicas)
+    if len(results) == 0:
+        print('No replicas finished')
+        return
+    dates, bands = aggregate(results, args.percentiles)
+    outfile = os.path.join(args.base_dir, run_sim.simulation_name(args.telescopes, args.threshold, args.mode) +
+                           '_ensemble.csv')
+    write_ensemble_results(dates, bands, len(results), outfile)
+    print('Ensemble of ' + str(len(results)) + ' replicas written to ' + outfile)
+
+
+if __name__ == '__main__':
+    main()
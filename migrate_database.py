@@ -0,0 +1,136 @@
+#################################################################
+# Code to bring existing database files up to date with the     #
+# current schema                                                #
+# Moves observations from the old per-target tables into the    #
+# single OBSERVATIONS table, and converts stored transit and    #
+# schedule times between text and numeric formats               #
+# Run on clean databases once, called by run_sim.py for any     #
+# copy that has not been migrated                               #
+#################################################################
+
+
+def parse_arguments():
+    """
+    Allows arguments to be parsed when this method is called
+    :return: files: database files to be migrated: list of str
+    :return: time_format: format to store times in, None to leave unchanged: str
+    """
+    import argparse
+    parser = argparse.ArgumentParser(description='Migrate database files to the current schema')
+    parser.add_argument('files', type=str, nargs='+', help='database files to migrate')
+    parser.add_argument('--time-format', type=str, choices=['text', 'jd', 'seconds'], default=None,
+                        help='store transit and schedule times as datetime text, JD - 2400000, or seconds since 1970')
+    args = parser.parse_args()
+    return args.files, args.time_format
+
+
+def needs_migration(cursor):
+    """
+    Check whether a database still stores observations in per-target tables
+    :param cursor: Cursor connected to database: cursor
+    :return: True if the OBSERVATIONS table does not exist: bool
+    """
+    row = cursor.execute('SELECT name FROM sqlite_master WHERE type = "table" AND name = "OBSERVATIONS"').fetchone()
+    return row is None
+
+
+def migrate_observations(cursor):
+    """
+    Copy the observations of each target into the OBSERVATIONS table and remove the per-target tables
+    :param cursor: Cursor connected to database: cursor
+    :return: Number of observations moved: int
+    """
+    import data_tools
+    columns = 'ObID, Epoch, ObsCenter, ObsCenterErr, TrueCenter, TrueCenterErr, ObsDepth, ObsDepthErr, ObsDuration, ' \
+              'ObsDurationErr, Source'
+    data_tools.create_obs_table(cursor)
+    tables = set(row[0] for row in cursor.execute('SELECT name FROM sqlite_master WHERE type = "table"'))
+    names = [row[0] for row in cursor.execute('SELECT Name FROM TARGET_DATA')]
+    moved = 0
+    for name in names:
+        if name not in tables:
+            continue
+        # copy in insertion order, skipping any repeated transit centers
+        cursor.execute('INSERT OR IGNORE INTO OBSERVATIONS (Target, ' + columns + ') SELECT ?, ' + columns +
+                       ' FROM "' + name + '" ORDER BY rowid', (name,))
+        moved += cursor.rowcount
+        cursor.execute('DROP TABLE "' + name + '"')
+    return moved
+
+
+def convert_times(cursor, time_format):
+    """
+    Convert the times stored in DEEP_TRANSITS and each telescope schedule table to a new format
+    :param cursor: Cursor connected to database: cursor
+    :param time_format: 'text', 'jd' or 'seconds': str
+    :return: Number of rows converted: int
+    """
+    import data_tools
+    old_format = data_tools.read_time_format(cursor)
+    tables = set(row[0] for row in cursor.execute('SELECT name FROM sqlite_master WHERE type = "table"'))
+
+    # time columns and duration column of each table
+    conversions = []
+    if 'DEEP_TRANSITS' in tables:
+        conversions.append(('DEEP_TRANSITS', ['Center', 'Ingress', 'Egress'], 'Duration'))
+    if 'TELESCOPES' in tables:
+        for row in cursor.execute('SELECT * FROM TELESCOPES').fetchall():
+            if row[0] in tables:
+                conversions.append((row[0], ['ObsCenter', 'RunStart', 'RunEnd'], 'RunDuration'))
+
+    converted = 0
+    for table, time_columns, duration_column in conversions:
+        rows = cursor.execute('SELECT ' + ', '.join(time_columns + [duration_column]) + ', rowid FROM "' + table +
+                              '"').fetchall()
+        new_rows = []
+        for row in rows:
+            new_row = [data_tools.time_to_value(data_tools.value_to_time(value, old_format), time_format)
+                       for value in row[:-2]]
+            new_row.append(data_tools.duration_to_value(data_tools.value_to_duration(row[-2], old_format),
+                                                        time_format))
+            new_rows.append(new_row + [row[-1]])
+        assignments = ', '.join(column + ' = ?' for column in time_columns + [duration_column])
+        cursor.executemany('UPDATE "' + table + '" SET ' + assignments + ' WHERE rowid = ?', new_rows)
+        converted += len(new_rows)
+    data_tools.set_time_format(cursor, time_format)
+    return converted
+
+
+def migrate(database_name, time_format=None):
+    """
+    Migrate a single database file in place
+    :param database_name: Location of database file: str
+    :param time_format: Format to store times in, 'text', 'jd' or 'seconds', None to leave unchanged: str
+    :return: True if the file was changed: bool
+    """
+    import data_tools
+    import sqlite3
+    db = sqlite3.connect(database_name)
+    cursor = db.cursor()
+    changed = False
+    if needs_migration(cursor):
+        moved = migrate_observations(cursor)
+        db.commit()
+        print('Moved', moved, 'observations in', database_name)
+        changed = True
+    if time_format is not None and time_format != data_tools.read_time_format(cursor):
+        converted = convert_times(cursor, time_format)
+        db.commit()
+        print('Converted times in', converted, 'rows of', database_name, 'to', time_format)
+        changed = True
+    if changed:
+        # reclaim the space freed by dropped tables and shorter values
+        cursor.execute('VACUUM')
+    db.close()
+    return changed
+
+
+def main():
+    files, time_format = parse_arguments()
+    for database_name in files:
+        if not migrate(database_name, time_format):
+            print(database_name, 'already up to date')
+
+
+if __name__ == '__main__':
+    main()
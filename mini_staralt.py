@@ -15,6 +15,117 @@ class NeverVisibleError(Error):
 class AlwaysVisibleError(Error):
     pass
 
+
+class RiseSetCache:
+    """
+    Bounded cache of sun and target rise/set results, keyed on quantised inputs, evicting the least recently used
+    Counts hits, misses and evictions so the amount of repeated calculation can be reported
+    """
+    def __init__(self, size=100000, decimals=4):
+        """
+        Constructor for an empty cache
+        :param size: Maximum number of results stored: int
+        :param decimals: Number of decimal places coordinates and altitudes are rounded to in keys: int
+        """
+        from collections import OrderedDict
+        self.size = size
+        self.decimals = decimals
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, kind, date, *values):
+        """
+        Build key for a calculation, dates are quantised to the second and other values to self.decimals
+        :param kind: Type of calculation: str
+        :param date: Start date of calculation: datetime
+        :param values: Coordinates and altitude used in calculation: floats
+        :return: Key: tuple
+        """
+        return (kind, date.replace(microsecond=0)) + tuple(round(float(value), self.decimals) for value in values)
+
+    def get(self, key):
+        """
+        Look up a stored result, marking it as recently used
+        :param key: Key from self.key
+        :return: Stored result, None if not stored
+        """
+        try:
+            value = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """
+        Store a result, evicting the least recently used result if full
+        :param key: Key from self.key
+        :param value: Result to store
+        """
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def report(self):
+        """
+        Summarise cache usage
+        :return: Summary: str
+        """
+        lookups = self.hits + self.misses
+        rate = self.hits / lookups * 100 if lookups != 0 else 0
+        return 'Rise/set cache: ' + str(self.hits) + ' hits, ' + str(self.misses) + ' misses (' + \
+               str(round(rate, 1)) + '% hit rate), ' + str(self.evictions) + ' evictions, ' + \
+               str(len(self.entries)) + '/' + str(self.size) + ' stored'
+
+
+cache = None  # RiseSetCache used by sun_set_rise_batch and target_rise_set_batch, disabled by default
+
+
+def enable_cache(size=100000, decimals=4):
+
+    # input: maximum number of results, decimal places for quantising coordinates
+    # start caching sun_set_rise_batch and target_rise_set_batch results for each date and site (and target),
+    # return the cache
+
+    global cache
+    cache = RiseSetCache(size, decimals)
+    return cache
+
+
+def disable_cache():
+
+    # stop caching and discard stored results
+
+    global cache
+    cache = None
+
+
+def cached_batch(kind, dates, values, calculate, outputs):
+
+    # input: type of calculation, start dates and other inputs (coordinates, altitude) broadcast against each other,
+    # function calculating the results for 1D arrays of dates and inputs, number of results
+    # return each result for every element, looking each element up in the cache and calculating the rest at once
+
+    arrays = np.broadcast_arrays(np.asarray(dates, dtype=object), *[np.asarray(value, dtype=float) for value in values])
+    shape = arrays[0].shape
+    dates, values = arrays[0].ravel(), [array.ravel() for array in arrays[1:]]
+    keys = [cache.key(kind, date, *element) for date, *element in zip(dates, *values)]
+    results = [cache.get(key) for key in keys]
+    missing = [i for i in range(len(keys)) if results[i] is None]
+    if len(missing) != 0:
+        calculated = calculate(list(dates[missing]), *[value[missing] for value in values])
+        for i, result in zip(missing, zip(*calculated)):
+            results[i] = tuple(float(value) for value in result)
+            cache.put(keys[i], results[i])
+    return [np.array([result[j] for result in results], dtype=float).reshape(shape) for j in range(outputs)]
+
+
 def get_gmst(j_date):
 
     # input: julian date
@@ -45,9 +156,181 @@ def get_gmst_utc_diff(date):
     return gmst_utc_diff
 
 
+def julian_date_array(dates):
+
+    # input: sequence of UTC datetimes
+    # return Julian dates and seconds since midnight for each date, as arrays (same as pyasl.jdcnv, but vectorised)
+
+    stamps = np.asarray(dates, dtype='datetime64[us]')
+    jd = (stamps - np.datetime64('1970-01-01T00:00:00', 'us')) / np.timedelta64(1, 'D') + 2440587.5
+    day_seconds = (stamps - stamps.astype('datetime64[D]')) / np.timedelta64(1, 's')
+    return jd, day_seconds
+
+
+def get_gmst_array(j_date):
+
+    # input: array of julian dates
+    # return GMST for each julian date, see get_gmst
+
+    du = j_date - 2451545
+    du_mod = np.fmod(du, 1)
+    T = (j_date - 2451545) / 36525
+    gmst_sec = 86400 * (
+                0.7790572732640 + 0.00273781191135448 * du + du_mod) + 0.00096707 + 307.47710227 * T + 0.092772113 * (
+                           T ** 2) - 0.0000000293 * (T ** 3) + 0.00000199707 * (T ** 4) - 0.000000002453 * (T ** 5)
+    gmst_deg = np.fmod(gmst_sec / 3600, 24)
+    return gmst_deg
+
+
+def get_gmst_utc_diff_array(jd, day_seconds):
+
+    # input: arrays of julian dates and UTC seconds since midnight for the same instants
+    # get gmst/utc difference for each instant, see get_gmst_utc_diff
+
+    gmst_dec = get_gmst_array(jd)
+    # whole seconds only, as the datetime based version ignores microseconds
+    date_dec = np.floor(np.round(np.mod(day_seconds, 86400), 6)) / 3600
+    gmst_utc_diff = gmst_dec - date_dec
+    return np.where(gmst_utc_diff < 0, gmst_utc_diff + 24, gmst_utc_diff)
+
+
+def get_hour_angle_factor(dec, lat, h=0):
+
+    # input: dec, lat, altitude h (degrees), scalars or arrays
+    # return cos of the hour angle at which an object crosses altitude h
+    # factor < -1 means the object never drops below h, factor > 1 means it never reaches h
+
+    return (np.sin(h * np.pi / 180) - np.sin(dec * np.pi / 180) * np.sin(
+        lat * np.pi / 180)) / (np.cos(dec * np.pi / 180) * np.cos(lat * np.pi / 180))
+
+
+def refine_events_array(start_jd, start_seconds, first, second, lon, skip_negative_check=False):
+
+    # input: 1D arrays of start julian dates, seconds since midnight, sidereal times (hours) of the first and second
+    # events of the night (set then rise, or rise then set), and longitudes
+    # return UTC times of both events in hours after each start date
+    # elements drop out of the refinement once converged, so each one takes the same steps as the scalar algorithm
+    # and the loop is bounded rather than open ended
+
+    # adjust using gmst / utc difference for start date (midnight, need further adjustment - see later)
+    gmst_utc_diff = get_gmst_utc_diff_array(start_jd, start_seconds)
+
+    # refine lst adjustment for both events (get gmst/utc difference at exactly first, second)
+    first_lst_adj_tmp = np.zeros_like(first)
+    second_lst_adj_tmp = np.zeros_like(second)
+    first_lst_adj = np.zeros_like(first)
+    second_lst_adj = np.zeros_like(second)
+    gmst_utc_diff_first = gmst_utc_diff.copy()
+    gmst_utc_diff_second = gmst_utc_diff.copy()
+    active = np.ones(first.shape, dtype=bool)
+    iterations = 0
+    while active.any() and iterations < 20:
+        idx = np.flatnonzero(active)
+        first_final_tmp = first[idx] - gmst_utc_diff_first[idx] - lon[idx] / 15
+        second_final_tmp = second[idx] - gmst_utc_diff_second[idx] - lon[idx] / 15
+        shift = np.where(first_final_tmp < 0, 24, 0)
+        first_final_tmp = first_final_tmp + shift
+        second_final_tmp = second_final_tmp + shift
+        gmst_utc_diff_first[idx] = get_gmst_utc_diff_array(start_jd[idx] + first_final_tmp / 24,
+                                                           start_seconds[idx] + first_final_tmp * 3600)
+        gmst_utc_diff_second[idx] = get_gmst_utc_diff_array(start_jd[idx] + second_final_tmp / 24,
+                                                            start_seconds[idx] + second_final_tmp * 3600)
+        first_adj = first[idx] - gmst_utc_diff_first[idx]
+        second_adj = second[idx] - gmst_utc_diff_second[idx]
+        shift = np.where(first_adj < 0, 24, 0)
+        first_lst_adj[idx] = first_adj + shift
+        second_lst_adj[idx] = second_adj + shift
+        diff = np.abs(first_lst_adj_tmp[idx] - first_lst_adj[idx]) + \
+            np.abs(second_lst_adj_tmp[idx] - second_lst_adj[idx])
+        first_lst_adj_tmp[idx] = first_lst_adj[idx]
+        second_lst_adj_tmp[idx] = second_lst_adj[idx]
+        active[idx] = diff > 1  # until accuracy is less than a second
+        iterations += 1
+
+    # adjust for longitude
+    first_final = first_lst_adj - lon / 15
+    second_final = second_lst_adj - lon / 15
+
+    if not skip_negative_check:
+        # first event is the previous day. Therefore get times for next day, then add 24h
+        negative = np.flatnonzero(first_final < 0)
+        if len(negative) != 0:
+            first_plus1day, second_plus1day = refine_events_array(
+                start_jd[negative] + 1, start_seconds[negative], first[negative], second[negative], lon[negative],
+                skip_negative_check=True)
+            first_final[negative] = first_plus1day + 24
+            second_final[negative] = second_plus1day + 24
+
+    return first_final, second_final
+
+
+def get_set_rise_array(start_jd, start_seconds, ra, dec, lon, lat, h=0, skip_negative_check=False):
+
+    # input: arrays of julian dates and seconds since midnight for the start dates, ra (hours), dec, lon, lat (degrees)
+    # return set and rise times in hours after each start date, NaN where the object never sets or never rises
+    # same algorithm as get_set_rise, applied to every element at once
+
+    start_jd, start_seconds, ra, dec, lon, lat = np.broadcast_arrays(
+        *[np.asarray(value, dtype=float) for value in (start_jd, start_seconds, ra, dec, lon, lat)])
+    shape = start_jd.shape
+    start_jd, start_seconds, ra, dec, lon, lat = [value.ravel() for value in
+                                                  (start_jd, start_seconds, ra, dec, lon, lat)]
+
+    factor = get_hour_angle_factor(dec, lat, h)
+    valid = np.flatnonzero(~((factor < -1) | (factor > 1)))
+
+    HA = np.arccos(factor[valid]) * 180 / np.pi
+
+    rise = ra[valid] - HA / 15. + 24  # shift rise by 24h, so we have set first, then rise
+    set = ra[valid] + HA / 15.
+    shift = np.where(set < 0, 24, 0)
+
+    set_final = np.full(shape, np.nan).ravel()
+    rise_final = np.full(shape, np.nan).ravel()
+    set_final[valid], rise_final[valid] = refine_events_array(start_jd[valid], start_seconds[valid], set + shift,
+                                                              rise + shift, lon[valid], skip_negative_check)
+
+    return set_final.reshape(shape), rise_final.reshape(shape)
+
+
+def get_rise_set_array(start_jd, start_seconds, ra, dec, lon, lat, h=0, skip_negative_check=False):
+
+    # input: arrays of julian dates and seconds since midnight for the start dates, ra (hours), dec, lon, lat (degrees)
+    # return rise and set times in hours after each start date, and masks for targets that never reach altitude h,
+    # and that never drop below it. Times are NaN wherever either mask is set
+    # same algorithm as get_rise_set, applied to every element at once
+
+    start_jd, start_seconds, ra, dec, lon, lat = np.broadcast_arrays(
+        *[np.asarray(value, dtype=float) for value in (start_jd, start_seconds, ra, dec, lon, lat)])
+    shape = start_jd.shape
+    start_jd, start_seconds, ra, dec, lon, lat = [value.ravel() for value in
+                                                  (start_jd, start_seconds, ra, dec, lon, lat)]
+
+    factor = get_hour_angle_factor(dec, lat, h)
+    never_visible = factor > 1
+    always_visible = factor < -1
+    valid = np.flatnonzero(~(never_visible | always_visible))
+
+    HA = np.arccos(factor[valid]) * 180 / np.pi
+
+    rise = ra[valid] - HA / 15.
+    set = ra[valid] + HA / 15.
+    shift = np.where(rise < 0, 24, 0)
+
+    rise_final = np.full(shape, np.nan).ravel()
+    set_final = np.full(shape, np.nan).ravel()
+    rise_final[valid], set_final[valid] = refine_events_array(start_jd[valid], start_seconds[valid], rise + shift,
+                                                              set + shift, lon[valid], skip_negative_check)
+
+    return rise_final.reshape(shape), set_final.reshape(shape), never_visible.reshape(shape), \
+        always_visible.reshape(shape)
+
+
 def get_set_rise(start_date, ra, dec, lon, lat, h=0, skip_negative_check=False):
-    import math
-    import datetime
+
+    # input: UTC datetime, ra (hours), dec, lon, lat (degrees)
+    # return set and rise times in hours after start_date
+    # scalar version of get_set_rise_array, kept separate as the array set up is slow for a single input
 
     factor = (math.sin(h * math.pi / 180) - math.sin(dec * math.pi / 180) * math.sin(
         lat * math.pi / 180)) / (math.cos(dec * math.pi / 180) * math.cos(lat * math.pi / 180))
@@ -124,6 +407,11 @@ def get_set_rise(start_date, ra, dec, lon, lat, h=0, skip_negative_check=False):
 
 
 def get_rise_set(start_date, ra, dec, lon, lat, h=0, skip_negative_check=False):
+
+    # input: UTC datetime, ra (hours), dec, lon, lat (degrees)
+    # return rise and set times in hours after start_date
+    # scalar version of get_rise_set_array, kept separate as the array set up is slow for a single input
+
     factor = (math.sin(h * math.pi / 180) - math.sin(dec * math.pi / 180) * math.sin(
         lat * math.pi / 180)) / (math.cos(dec * math.pi / 180) * math.cos(lat * math.pi / 180))
 
@@ -198,25 +486,85 @@ def get_rise_set(start_date, ra, dec, lon, lat, h=0, skip_negative_check=False):
             raise NeverVisibleError
 
 
-def sun_set_rise(start_date, lon, lat, sundown):
-    from PyAstronomy import pyasl
-
-    jd_set = pyasl.jdcnv(start_date)  # find Julian date
-    sunpos = pyasl.sunpos(jd_set)
+def sun_set_rise_batch(dates, lon, lat, sundown):
+    """
+    Calculate sunset and sunrise for many dates and sites in a single call
+    :param dates: Sequence of start dates: datetime
+    :param lon: Longitudes of sites: array of floats
+    :param lat: Latitudes of sites, same length as lon: array of floats
+    :param sundown: Altitude of the sun defining night: float
+    :return set_hours: Sunset in hours after each date, shape (dates, sites), NaN where there is no sunset
+    :return rise_hours: Sunrise in hours after each date, shape (dates, sites), NaN where there is no sunrise
+    """
+    if cache is not None:
+        def calculate(dates, lon, lat, sundown):
+            # sun position for each element rather than each date, as the elements are not on a grid
+            start_jd, start_seconds = julian_date_array(dates)
+            sunpos = pyasl.sunpos(start_jd)
+            return get_set_rise_array(start_jd, start_seconds, sunpos[1][0] / 15, sunpos[2][0], lon, lat, h=sundown)
+
+        return tuple(cached_batch('sun', np.asarray(dates, dtype=object)[:, np.newaxis],
+                                  [np.asarray(lon, dtype=float)[np.newaxis, :],
+                                   np.asarray(lat, dtype=float)[np.newaxis, :], sundown], calculate, 2))
+
+    start_jd, start_seconds = julian_date_array(dates)
+    sunpos = pyasl.sunpos(start_jd)
     sun_ra, sun_dec = sunpos[1][0], sunpos[2][0]
 
-    try:
-        set, rise = get_set_rise(start_date, sun_ra/15, sun_dec, lon, lat, h=sundown)
-        set_date_final = start_date + datetime.timedelta(seconds=set * 60 * 60)
-        rise_date_final = start_date + datetime.timedelta(seconds=rise * 60 * 60)
+    # dates along the first axis, sites along the second
+    lon = np.asarray(lon, dtype=float)[np.newaxis, :]
+    lat = np.asarray(lat, dtype=float)[np.newaxis, :]
+    set_hours, rise_hours = get_set_rise_array(start_jd[:, np.newaxis], start_seconds[:, np.newaxis],
+                                               sun_ra[:, np.newaxis] / 15, sun_dec[:, np.newaxis], lon, lat, h=sundown)
+
+    # TODO we should actually adjust for RA and DEC at rise / set
 
-        # TODO we should actually adjust for RA and DEC at rise / set
+    return set_hours, rise_hours
 
-        return set_date_final, rise_date_final
 
-    except:
+def sun_set_rise(start_date, lon, lat, sundown):
 
-        pass
+    jd_set = pyasl.jdcnv(start_date)  # find Julian date
+    sunpos = pyasl.sunpos(jd_set)
+    sun_ra, sun_dec = sunpos[1][0], sunpos[2][0]
+    try:
+        set, rise = get_set_rise(start_date, sun_ra / 15, sun_dec, lon, lat, h=sundown)
+    except Warning:
+        return None  # no sunset or no sunrise
+
+    set_date_final = start_date + datetime.timedelta(seconds=set * 60 * 60)
+    rise_date_final = start_date + datetime.timedelta(seconds=rise * 60 * 60)
+
+    return set_date_final, rise_date_final
+
+
+def target_rise_set_batch(dates, ra, dec, lon, lat, mintargetalt):
+    """
+    Calculate target rise and set for many dates, targets and sites in a single call, without raising for targets
+    that never rise or never set
+    :param dates: Start dates: sequence of datetimes, broadcast against the other arguments
+    :param ra: Right ascension of targets in degrees: array of floats
+    :param dec: Declination of targets in degrees: array of floats
+    :param lon: Longitudes of sites: array of floats
+    :param lat: Latitudes of sites: array of floats
+    :param mintargetalt: Minimum altitude of the target: float
+    :return rise_hours: Rise in hours after each date, NaN where masked
+    :return set_hours: Set in hours after each date, NaN where masked
+    :return never_visible: Mask of targets that never reach mintargetalt
+    :return always_visible: Mask of targets that never drop below mintargetalt
+    """
+    if cache is not None:
+        def calculate(dates, ra, dec, lon, lat, mintargetalt):
+            start_jd, start_seconds = julian_date_array(dates)
+            return get_rise_set_array(start_jd, start_seconds, ra / 15, dec, lon, lat, h=mintargetalt)
+
+        rise_hours, set_hours, never_visible, always_visible = cached_batch(
+            'target', dates, [ra, dec, lon, lat, mintargetalt], calculate, 4)
+        return rise_hours, set_hours, never_visible != 0, always_visible != 0
+
+    start_jd, start_seconds = julian_date_array(dates)
+    return get_rise_set_array(start_jd, start_seconds, np.asarray(ra, dtype=float) / 15, dec, lon, lat,
+                              h=mintargetalt)
 
 
 def target_rise_set(date, ra, dec, lon, lat, mintargetalt):
@@ -7,18 +7,48 @@
 #################################################################
 
 
-def flip_unfair_coin():
+def make_rng(seed=None, stream=None):
     """
-    Determines the success of an observation by flipping a weighted coin
-    :return: Success: boolean
+    Create random number generator for a simulation, independent of the generators of other streams of the same seed
+    :param seed: Seed, None for fresh entropy from the system: int
+    :param stream: Number of stream, e.g. replica or worker, giving the same generator as SeedSequence(seed).spawn: int
+    :return: numpy Generator
+    """
+    import numpy as np
+    if stream is None:
+        sequence = np.random.SeedSequence(seed)
+    else:
+        sequence = np.random.SeedSequence(seed, spawn_key=(stream,))
+    return np.random.default_rng(sequence)
+
+
+def flip_unfair_coins(rng, size):
+    """
+    Determines the success of many observations at once by flipping a weighted coin for each
+    :param rng: Random number generator: numpy Generator
+    :param size: Number of observations: int
+    :return: Success of each observation: array of booleans
     """
-    import random
     chance = 0.6
-    return True if random.random() < chance else False
-    #return True
+    return rng.random(size) < chance
+
+
+def draw_result_noise(rng, size):
+    """
+    Draw the random parts of the results of many simulated observations at once
+    :param rng: Random number generator: numpy Generator
+    :param size: Number of observations: int
+    :return tmid_offsets: Offset of each measured transit center from the expected center: array of floats
+    :return tmid_errs: Error of each measured transit center: array of floats
+    """
+    import numpy as np
+    # nominal uncertainty of half a minute
+    tmid_offsets = rng.normal(0, 0.5/24/60, size)
+    tmid_errs = np.abs(rng.normal(0.5, 0.01, size)/24/60)
+    return tmid_offsets, tmid_errs
 
 
-def generate_results(last_tmid, last_tmid_err, last_epoch, new_epoch, period):
+def generate_results(last_tmid, last_tmid_err, last_epoch, new_epoch, period, tmid_offset, tmid_err):
     """
     Generates results from a simulated observation based on target data
     :param last_tmid: Transit center of latest observation: float
@@ -26,21 +56,16 @@ def generate_results(last_tmid, last_tmid_err, last_epoch, new_epoch, period):
     :param last_epoch: Epoch of latest observation: int
     :param new_epoch: Epoch of new observation: int
     :param period: Current period of the target: days
+    :param tmid_offset: Random offset of measured center, from draw_result_noise: float
+    :param tmid_err: Random error of measured center, from draw_result_noise: float
     :return: New transit center w/error: float
     """
-    from random import gauss
     # calculate expected tmid from known period, last observation and epochs passed
     epoch_dif = new_epoch - last_epoch
     new_tmid_exp = last_tmid + period*epoch_dif
-    #if last_tmid_err is not None:
-    #    new_tmid = gauss(new_tmid_exp, last_tmid_err)
-    #    new_tmid_err = abs(gauss(0, last_tmid_err))
-    #else:
-    #    new_tmid = new_tmid_exp
-    #    new_tmid_err = 'NULL'
     # generate new values from expected tmid and nominal uncertainty
-    new_tmid = gauss(new_tmid_exp, 0.5/24/60)
-    new_tmid_err = abs(gauss(0.5, 0.01)/24/60)
+    new_tmid = new_tmid_exp + float(tmid_offset)
+    new_tmid_err = float(tmid_err)
     return new_tmid, new_tmid_err
 
 
@@ -51,6 +76,35 @@ def find_true_t0(true_t0, true_period, last_true_epoch, epoch):
     return new_true_t0
 
 
+def night_visibility(center, ingress, egress, sunset, sunrise, target_rise, target_set, always_visible):
+    """
+    Checks transits against night and target visibility windows at a set of sites. Where the windows found for the
+    transit date start after the transit, the windows for the day before are used instead
+    :param center: Transit centers in hours after midnight of the transit date: array of floats
+    :param ingress: Transit ingresses in hours after midnight of the transit date: array of floats
+    :param egress: Transit egresses in hours after midnight of the transit date: array of floats
+    :param sunset: Sunset in hours after midnight, for the transit date then the day before: pair of arrays
+    :param sunrise: Sunrise in hours after midnight, for the transit date then the day before: pair of arrays
+    :param target_rise: Target rise in hours after midnight, for the transit date then the day before: pair of arrays
+    :param target_set: Target set in hours after midnight, for the transit date then the day before: pair of arrays
+    :param always_visible: Mask of sites where the target never sets: array of booleans
+    :return: Mask of sites the transit is visible from: array of booleans
+    """
+    # check sunrise/set against in/egress
+    sun_down = (ingress > sunset[0]) & (egress < sunrise[0])
+    # if calculation was made for wrong day, step back (times for the day before are 24h earlier)
+    sun_down |= ~(ingress > sunset[0]) & (sunset[0] > center) & \
+        (ingress > sunset[1] - 24) & (egress < sunrise[1] - 24)
+
+    # check target rise/set against in/egress
+    visible = (ingress > target_rise[0]) & (egress < target_set[0])
+    # if calculation made for wrong day, step back
+    visible |= ~(ingress > target_rise[0]) & (target_rise[0] > center) & \
+        (ingress > target_rise[1] - 24) & (egress < target_set[1] - 24)
+
+    return sun_down & (visible | always_visible)
+
+
 class Transit:
     """
     Transit object, contains data for a single transit
@@ -60,106 +114,136 @@ class Transit:
         """
         Null constructor, populated by gen_from_database
         """
-        self.center = None
         self.name = None
-        self.ingress = None
-        self.egress = None
-        self.duration = None
         self.ra = None
         self.dec = None
         self.loss = None
         self.telescope = []
         self.epoch = None
         self.error = None
+        # times as stored in the database, converted to datetime and timedelta when first used
+        self.values = [None, None, None, None]
+        self.times = [None, None, None, None]
+        self.time_format = 'text'
 
-    def gen_from_database(self, row):
+    def gen_from_database(self, row, time_format='text'):
         """
         Creates Transit object for a single row of data
         :param row: Array of values to be stored in Transit object
+        :param time_format: Format of times in row, 'text', 'jd' or 'seconds': str
         """
-        import datetime
-        try:
-            self.center = datetime.datetime.strptime(row[0], '%Y-%m-%d %H:%M:%S.%f')
-        except ValueError:
-            self.center = datetime.datetime.strptime(row[0], '%Y-%m-%d %H:%M:%S')
+        self.values = [row[0], row[2], row[3], row[4]]
+        self.times = [None, None, None, None]
+        self.time_format = time_format
         self.name = row[1]
-        try:
-            self.ingress = datetime.datetime.strptime(row[2], '%Y-%m-%d %H:%M:%S.%f')
-        except ValueError:
-            self.ingress = datetime.datetime.strptime(row[2], '%Y-%m-%d %H:%M:%S')
-        try:
-            self.egress = datetime.datetime.strptime(row[3], '%Y-%m-%d %H:%M:%S.%f')
-        except ValueError:
-            self.egress = datetime.datetime.strptime(row[3], '%Y-%m-%d %H:%M:%S')
-        time_split = row[4].split(':')
-        self.duration = datetime.timedelta(hours=float(time_split[0]), minutes=float(time_split[1]), seconds=float(time_split[2]))
         self.ra = row[5]
         self.dec = row[6]
         self.loss = row[7]
         self.epoch = row[8]
         self.error = row[9]
 
-    def check_visibility_telescopes(self, telescopes):
+    def time(self, i):
+        """
+        Obtain a stored time, converting it the first time it is used
+        :param i: Position of time in values, 0 for center, 1 for ingress, 2 for egress, 3 for duration: int
+        :return: datetime, or timedelta for duration
+        """
+        import data_tools
+        if self.times[i] is None and self.values[i] is not None:
+            if i == 3:
+                self.times[i] = data_tools.value_to_duration(self.values[i], self.time_format)
+            else:
+                self.times[i] = data_tools.value_to_time(self.values[i], self.time_format)
+        return self.times[i]
+
+    def set_time(self, i, time):
+        """
+        Set a time directly, storing it in the format of the database
+        :param i: Position of time in values, 0 for center, 1 for ingress, 2 for egress, 3 for duration: int
+        :param time: datetime, or timedelta for duration
+        """
+        import data_tools
+        self.times[i] = time
+        if i == 3:
+            self.values[i] = data_tools.duration_to_value(time, self.time_format)
+        else:
+            self.values[i] = data_tools.time_to_value(time, self.time_format)
+
+    @property
+    def center(self):
+        return self.time(0)
+
+    @center.setter
+    def center(self, time):
+        self.set_time(0, time)
+
+    @property
+    def ingress(self):
+        return self.time(1)
+
+    @ingress.setter
+    def ingress(self, time):
+        self.set_time(1, time)
+
+    @property
+    def egress(self):
+        return self.time(2)
+
+    @egress.setter
+    def egress(self, time):
+        self.set_time(2, time)
+
+    @property
+    def duration(self):
+        return self.time(3)
+
+    @duration.setter
+    def duration(self, time):
+        self.set_time(3, time)
+
+    def check_visibility_telescopes(self, telescopes, night_table=None, target_table=None):
         """
         Checks the visibility of a transit from specific telescopes and stores acceptable ones in Transit object
         :param telescopes: List of Telescope objects transit will be checked against
+        :param night_table: NightTable object to read night windows from, calculated directly if not given
+        :param target_table: TargetTable object to read target windows from, calculated directly if not given
         :return: Boolean for visibility
         """
+        import numpy as np
+        import data_tools
         import mini_staralt
         from datetime import timedelta
         accept = False
 
-        while not accept:
-            # loop for telescopes
-            for telescope in telescopes:
-                # check is transit is during night at site
-                sun_down = False
-                sunset, sunrise = mini_staralt.sun_set_rise(
-                    self.center.replace(hour=0, second=0, minute=0, microsecond=0), lon=telescope.lon, lat=telescope.lat, sundown=-12)
-                # check sunrise/set against in/egress
-                if self.ingress > sunset:
-                    if self.egress < sunrise:
-                        sun_down = True
-                # if calculation was made for wrong day, step back and recalculate
-                elif sunset > self.center:
-                    sunset, sunrise = mini_staralt.sun_set_rise(
-                        self.center.replace(hour=0, second=0, minute=0, microsecond=0) - timedelta(days=1),
-                        lon=telescope.lon, lat=telescope.lat, sundown=-12)
-                    # check sunrise/set against in/egress
-                    if self.ingress > sunset:
-                        if self.egress < sunrise:
-                            sun_down = True
-
-                if sun_down:  # continue only if transit is during night
-                    try:
-                        # calculate target rise/set times
-                        target_rise, target_set = mini_staralt.target_rise_set(
-                            self.center.replace(hour=0, minute=0, second=0, microsecond=0),
-                            ra=self.ra, dec=self.dec, mintargetalt=20, lon=telescope.lon, lat=telescope.lat)
-                        # check target rise/set against in/egress
-                        if self.ingress > target_rise:
-                            if self.egress < target_set:
-                                self.telescope.append(telescope.name)  # add telescope name to viable list
-                                accept = True
-
-                        # if calculation made for wrong day, step back and recalculate
-                        elif target_rise > self.center:
-                            target_rise, target_set = mini_staralt.target_rise_set(
-                                self.center.replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=1),
-                                ra=self.ra, dec=self.dec, mintargetalt=20, lon=telescope.lon, lat=telescope.lat)
-                            # check target rise/set against in/egress
-                            if self.ingress > target_rise:
-                                if self.egress < target_set:
-                                    self.telescope.append(telescope.name)  # add telescope to viable list
-                                    accept = True
-                    except mini_staralt.NeverVisibleError:
-                        pass
-                    except mini_staralt.AlwaysVisibleError:
-                        # target is always visible
-                        accept = True
-                        self.telescope.append(telescope.name)  # add telescope to viable list
-
-            break
+        if len(telescopes) == 0:
+            return accept
+
+        # work in hours after midnight of the transit date
+        midnight, (center, ingress, egress) = data_tools.value_to_day_hours(self.values[:3], self.time_format)
+        if night_table is None:
+            night_table = NightTable([], midnight, midnight)
+
+        # find night windows at each site for this day and the day before
+        sunset, sunrise = night_table.sun_set_rise_hours(midnight, telescopes)
+        sunset_prev, sunrise_prev = night_table.sun_set_rise_hours(midnight - timedelta(days=1), telescopes)
+
+        # find target rise/set times for this day and the day before at every site at once
+        events = None
+        if target_table is not None:
+            events = target_table.rise_set_hours(self.name, midnight, telescopes)
+        if events is not None:
+            target_rise, target_set, always_visible = events
+        else:
+            target_rise, target_set, never_visible, always_visible = mini_staralt.target_rise_set_batch(
+                [[midnight], [midnight - timedelta(days=1)]], ra=self.ra, dec=self.dec,
+                lon=[telescope.lon for telescope in telescopes], lat=[telescope.lat for telescope in telescopes],
+                mintargetalt=20)
+
+        visible = night_visibility(center, ingress, egress, (sunset, sunset_prev), (sunrise, sunrise_prev),
+                                   target_rise, target_set, always_visible[0])
+        for site in np.flatnonzero(visible):
+            self.telescope.append(telescopes[site].name)  # add telescope name to viable list
+            accept = True
 
         return accept
 
@@ -193,6 +277,302 @@ class Telescope:
         self.aperture = row[4]
 
 
+class NightTable:
+    """
+    NightTable object, contains sunset and sunrise for every telescope on every date of a simulation, calculated once
+    Functions within look up night windows, and total night time over an interval using a running sum
+    """
+    def __init__(self, telescopes, start, end, sundown=-12, cache_dir=None):
+        """
+        Constructor, calculates night windows for each telescope at midnight of each date from start to end
+        :param telescopes: List of Telescope objects
+        :param start: First date of table: datetime
+        :param end: Last date of table: datetime
+        :param sundown: Altitude of the sun defining night: float
+        :param cache_dir: Folder of ephemeris files shared between processes, None to calculate in memory: str
+        """
+        import os
+        import numpy as np
+        from datetime import timedelta
+        import mini_staralt
+
+        self.first = start.replace(hour=0, minute=0, second=0, microsecond=0)
+        self.sundown = sundown
+        self.names = [telescope.name for telescope in telescopes]
+        self.columns = dict(zip(self.names, range(len(self.names))))
+        self.lons = np.array([telescope.lon for telescope in telescopes], dtype=float)
+        self.lats = np.array([telescope.lat for telescope in telescopes], dtype=float)
+
+        days = []
+        day = self.first
+        while day <= end:
+            days.append(day)
+            day += timedelta(days=1)
+        self.days = len(days)
+
+        def fill(out):
+            # sunset and sunrise in hours after midnight of each date, shape (2, dates, telescopes)
+            out[0], out[1] = mini_staralt.sun_set_rise_batch(days, lon=self.lons, lat=self.lats, sundown=sundown)
+
+        shape = (2, self.days, len(self.names))
+        if self.days == 0 or len(self.names) == 0:
+            sun = np.zeros(shape)
+        elif cache_dir is None:
+            sun = np.empty(shape)
+            fill(sun)
+        else:
+            key = ephemeris_key('night', self.names, self.lons, self.lats, self.first, self.days, sundown)
+            sun = cached_array(os.path.join(cache_dir, 'night_' + key + '.npy'), shape, fill)
+        self.sunset, self.sunrise = sun[0], sun[1]
+
+        # running total of night hours over all telescopes, so any interval is a difference of two entries
+        self.night_sum = np.concatenate(([0], np.cumsum(np.nansum(self.sunrise - self.sunset, axis=1))))
+
+    def day_index(self, date):
+        """
+        Find the row of the table for a given date
+        :param date: Date to look up: datetime
+        :return: Row index, may be outside the table: int
+        """
+        return (date.replace(hour=0, minute=0, second=0, microsecond=0) - self.first).days
+
+    def sun_set_rise_hours(self, date, telescopes):
+        """
+        Look up sunset and sunrise for a set of telescopes at midnight of a given date, calculating directly if the
+        date is outside the table
+        :param date: Date to look up: datetime
+        :param telescopes: List of Telescope objects
+        :return sunset: Sunset in hours after midnight of date: array of floats
+        :return sunrise: Sunrise in hours after midnight of date: array of floats
+        """
+        import mini_staralt
+        index = self.day_index(date)
+        if 0 <= index < self.days and all(telescope.name in self.columns for telescope in telescopes):
+            columns = [self.columns[telescope.name] for telescope in telescopes]
+            return self.sunset[index, columns], self.sunrise[index, columns]
+
+        midnight = date.replace(hour=0, minute=0, second=0, microsecond=0)
+        sunset, sunrise = mini_staralt.sun_set_rise_batch([midnight], lon=[telescope.lon for telescope in telescopes],
+                                                          lat=[telescope.lat for telescope in telescopes],
+                                                          sundown=self.sundown)
+        return sunset[0], sunrise[0]
+
+    def total_night(self, start, end):
+        """
+        Total night time summed over all telescopes for each date from start up to, but not including, end
+        :param start: Start of window: datetime
+        :param end: End of window: datetime
+        :return: Total night time: timedelta
+        """
+        from datetime import timedelta
+        first = self.day_index(start)
+        last = self.day_index(end)
+        if last <= first:
+            return timedelta(0)
+        if first < 0 or last > self.days:
+            # window not covered, build a table just for it
+            telescopes = []
+            for name, lon, lat in zip(self.names, self.lons, self.lats):
+                telescope = Telescope()
+                telescope.name, telescope.lon, telescope.lat = name, lon, lat
+                telescopes.append(telescope)
+            window = NightTable(telescopes, start, end - timedelta(days=1), self.sundown)
+            return timedelta(hours=float(window.night_sum[-1]))
+        return timedelta(hours=float(self.night_sum[last] - self.night_sum[first]))
+
+
+class TargetTable:
+    """
+    TargetTable object, contains target rise and set at every telescope for the dates of forecast transits only, keyed
+    by date and target, calculated for a batch of transits at a time as they are needed and dropped once the
+    simulation has passed their date
+    Not shared between simulations like the NightTable: the targets still forecast depend on the threshold and on the
+    outcomes of each simulation, and storing every target on every date is too large to be worth it
+    Functions within look up the target windows used to check the visibility of a transit
+    """
+    def __init__(self, names, ras, decs, telescopes, mintargetalt=20):
+        """
+        Constructor, stores the targets and telescopes, windows are calculated by prepare
+        :param names: Names of targets: list of str
+        :param ras: Right ascension of each target in degrees: list of floats
+        :param decs: Declination of each target in degrees: list of floats
+        :param telescopes: List of Telescope objects
+        :param mintargetalt: Minimum altitude of the target: float
+        """
+        import numpy as np
+        self.positions = {name: (float(ra), float(dec)) for name, ra, dec in zip(names, ras, decs)}
+        self.columns = dict(zip([telescope.name for telescope in telescopes], range(len(telescopes))))
+        self.lons = np.array([telescope.lon for telescope in telescopes], dtype=float)
+        self.lats = np.array([telescope.lat for telescope in telescopes], dtype=float)
+        self.mintargetalt = mintargetalt
+        self.events = {}  # rise, set and always visible flag at each telescope, shape (3, telescopes), by (date, name)
+
+    def prepare(self, transits):
+        """
+        Calculate target windows at midnight of the date of each transit and the day before, in one batch for all
+        dates and targets not already stored, forgetting any dates before these
+        :param transits: List of Transit objects
+        """
+        import numpy as np
+        import data_tools
+        import mini_staralt
+        from datetime import timedelta
+        needed = set()
+        for transit in transits:
+            if transit.name in self.positions:
+                midnight, hours = data_tools.value_to_day_hours(transit.values[:1], transit.time_format)
+                needed.add((midnight, transit.name))
+                needed.add((midnight - timedelta(days=1), transit.name))
+        if len(needed) == 0:
+            return
+
+        # the simulation only moves forward, so earlier dates are never looked up again
+        first = min(date for date, name in needed)
+        for key in [key for key in self.events if key[0] < first]:
+            del self.events[key]
+
+        keys = sorted(key for key in needed if key not in self.events)
+        if len(keys) == 0 or len(self.columns) == 0:
+            return
+        # rise, set and always visible flag, shape (date and target pairs, telescopes)
+        rise, target_set, never_visible, always_visible = mini_staralt.target_rise_set_batch(
+            [[date] for date, name in keys], [[self.positions[name][0]] for date, name in keys],
+            [[self.positions[name][1]] for date, name in keys], self.lons, self.lats, self.mintargetalt)
+        events = np.stack([rise, target_set, always_visible]).astype(float)
+        for i, key in enumerate(keys):
+            self.events[key] = events[:, i]
+
+    def rise_set_hours(self, name, date, telescopes):
+        """
+        Look up target windows at a set of telescopes at midnight of a given date and the day before
+        :param name: Name of target: str
+        :param date: Date to look up: datetime
+        :param telescopes: List of Telescope objects
+        :return: rise, set and always visible mask, each shape (2, telescopes), or None if not prepared
+        """
+        import numpy as np
+        from datetime import timedelta
+        midnight = date.replace(hour=0, minute=0, second=0, microsecond=0)
+        today = self.events.get((midnight, name))
+        yesterday = self.events.get((midnight - timedelta(days=1), name))
+        if today is None or yesterday is None:
+            return None
+        if not all(telescope.name in self.columns for telescope in telescopes):
+            return None
+        columns = [self.columns[telescope.name] for telescope in telescopes]
+        events = np.stack([today[:, columns], yesterday[:, columns]], axis=1)
+        return events[0], events[1], events[2] != 0
+
+
+def ephemeris_key(*values):
+    """
+    Key identifying a set of ephemeris calculations, the same in every process for the same inputs
+    :param values: Names, coordinates, dates and limits defining the calculation
+    :return: Hexadecimal key: str
+    """
+    import hashlib
+    import numpy as np
+    parts = []
+    for value in values:
+        if isinstance(value, np.ndarray):
+            value = [float(x) for x in value]
+        parts.append(repr(value))
+    return hashlib.sha1('|'.join(parts).encode()).hexdigest()[:20]
+
+
+def cached_array(path, shape, fill):
+    """
+    Attach read-only to an array file shared between processes, building it first if it does not exist
+    :param path: Location of .npy file: str
+    :param shape: Shape of array: tuple
+    :param fill: Function filling a new array with values: function
+    :return: Memory-mapped array, not copied into this process
+    """
+    import os
+    import numpy as np
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        # build under a temporary name so other processes never see a partial file
+        temporary = path + '.' + str(os.getpid()) + '.tmp'
+        out = np.lib.format.open_memmap(temporary, mode='w+', dtype=float, shape=shape)
+        fill(out)
+        out.flush()
+        del out
+        os.replace(temporary, path)
+    return np.load(path, mmap_mode='r')
+
+
+class ScheduleIndex:
+    """
+    ScheduleIndex object, contains the observing runs scheduled on a single telescope as sorted numeric times
+    Functions within check new runs for conflicts without reading the schedule table
+    """
+    def __init__(self):
+        """
+        Null constructor for an empty schedule, populated by gen_from_database and add
+        """
+        self.starts = []
+        self.ends = []
+        self.longest = 0
+
+    @staticmethod
+    def to_number(time):
+        """
+        Convert time to whole microseconds since 1970, so that comparisons are exact
+        :param time: Time to convert: datetime
+        :return: Microseconds: int
+        """
+        from datetime import datetime, timedelta
+        return (time - datetime(1970, 1, 1)) // timedelta(microseconds=1)
+
+    def gen_from_database(self, cursor, telescope, time_format='text'):
+        """
+        Populates ScheduleIndex object from the schedule table of a telescope
+        :param cursor: Cursor connected to database
+        :param telescope: Name of telescope: str
+        :param time_format: Format of times in the table, 'text', 'jd' or 'seconds': str
+        """
+        import data_tools
+        rows = cursor.execute('SELECT RunStart, RunEnd FROM "' + telescope + '"').fetchall()
+        for row in rows:
+            self.add(data_tools.value_to_time(row[0], time_format), data_tools.value_to_time(row[1], time_format))
+
+    def add(self, start, end):
+        """
+        Add a run to the index
+        :param start: Start of run: datetime
+        :param end: End of run: datetime
+        """
+        from bisect import bisect_right
+        start, end = self.to_number(start), self.to_number(end)
+        i = bisect_right(self.starts, start)
+        self.starts.insert(i, start)
+        self.ends.insert(i, end)
+        self.longest = max(self.longest, end - start)
+
+    def overlaps(self, start, end):
+        """
+        Check a new run against the runs already scheduled
+        :param start: Start of new run: datetime
+        :param end: End of new run: datetime
+        :return: True if the new run conflicts with a scheduled run: boolean
+        """
+        from bisect import bisect_left, bisect_right
+        new_start, new_end = self.to_number(start), self.to_number(end)
+        # only runs starting within the longest run length before the new run, up to its end, can conflict
+        first = bisect_right(self.starts, new_start - self.longest)
+        last = bisect_left(self.starts, new_end)
+        for i in range(first, last):
+            start_time, end_time = self.starts[i], self.ends[i]
+            if start_time < new_start < end_time:  # new observation starts before current one ends
+                return True
+            if start_time < new_end < end_time:  # new observation ends after current one starts
+                return True
+            if new_start < start_time and end_time < new_end:  # new observation surrounds current one
+                return True
+        return False
+
+
 def read_data(cursor, target):
     """
     Reads target data required to make transit forecast
@@ -219,9 +599,7 @@ def transit_forecast(data, name, start, end):
     import julian
 
     # extract data
-    current_dt = start
-    target_dt = end
-    current_ephemeris = julian.from_jd(data[0]+2400000, fmt='jd')  # convert dt to JD
+    last_ephemeris = julian.from_jd(data[0]+2400000, fmt='jd')  # convert dt to JD
     duration = timedelta(minutes=data[1])
     period = timedelta(days=data[2])
     ra = data[3]
@@ -230,20 +608,88 @@ def transit_forecast(data, name, start, end):
     epoch = data[6]
     error = data[7]
 
-    transits = []
-    # loop for all transits by the target in the window
-    while current_ephemeris < target_dt:
-        if current_ephemeris > current_dt:
-            # create new Transit2 object
-            candidate = Transit2(current_ephemeris, duration, ra, dec, period, loss, name, epoch, error)
-            if candidate.check_visibility_general():  # check visibility
-                transits.append(candidate)
-        current_ephemeris += period  # increment date
-        epoch += 1  # increment epochs
+    # find all transits by the target in the window
+    offsets, centers = forecast_epochs(last_ephemeris, period, start, end)
+    candidates = []
+    for offset, center in zip(offsets, centers.tolist()):
+        # create new Transit2 object
+        candidates.append(Transit2(center, duration, ra, dec, period, loss, name, epoch + int(offset), error))
+
+    # check visibility of all transits in the window at once
+    visible = check_visibility_general_batch(candidates)
+    transits = [candidate for candidate, accept in zip(candidates, visible) if accept]
 
     return transits
 
 
+def forecast_epochs(last_center, period, start, end):
+    """
+    Find the transits between start and end by counting whole periods on from the latest known transit
+    :param last_center: Center of latest known transit: datetime
+    :param period: Period of the target: timedelta
+    :param start: Start of window: datetime
+    :param end: End of window: datetime
+    :return offsets: Number of periods after last_center for each transit in the window: array of ints
+    :return centers: Center of each transit in the window: array of datetime64
+    """
+    import numpy as np
+
+    if period.total_seconds() <= 0:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype='datetime64[us]')
+
+    # range of whole periods that can fall in the window, one either side to allow for rounding
+    first = max(int((start - last_center) / period) - 1, 0)
+    last = max(int(np.ceil((end - last_center) / period)) + 1, 0)
+    offsets = np.arange(first, last + 1)
+
+    # centers in integer microseconds, so they match adding the period one transit at a time
+    centers = np.datetime64(last_center, 'us') + offsets * np.timedelta64(period, 'us')
+    window = (centers > np.datetime64(start, 'us')) & (centers < np.datetime64(end, 'us'))
+    return offsets[window], centers[window]
+
+
+def check_visibility_general_batch(transits):
+    """
+    Checks visibility of many Transit2 objects from somewhere on Earth at once
+    :param transits: List of Transit2 objects
+    :return: Visibility of each transit: array of booleans
+    """
+    import numpy as np
+    import mini_staralt
+    import datetime
+
+    if len(transits) == 0:
+        return np.zeros(0, dtype=bool)
+
+    # latitude and longitude combinations that cover entire globe
+    latitudes = [45, 0, -45]
+    longitudes = [0, 60, 120, 150, 180, 240, 300]
+    lat, lon = np.meshgrid(latitudes, longitudes, indexing='ij')
+    lat, lon = lat.ravel(), lon.ravel()
+
+    # dates for each transit, and the day before, then times in hours after midnight, shape (transits, 1)
+    dates = [transit.date for transit in transits]
+    dates_prev = [date - datetime.timedelta(days=1) for date in dates]
+    center = np.array([[(transit.center - transit.date).total_seconds() / 3600] for transit in transits])
+    ingress = np.array([[(transit.ingress - transit.date).total_seconds() / 3600] for transit in transits])
+    egress = np.array([[(transit.egress - transit.date).total_seconds() / 3600] for transit in transits])
+    ra = np.array([[transit.ra] for transit in transits], dtype=float)
+    dec = np.array([[transit.dec] for transit in transits], dtype=float)
+
+    # night at each coordinate, shape (2, transits, coordinates)
+    sunset, sunrise = mini_staralt.sun_set_rise_batch(dates + dates_prev, lon=lon, lat=lat, sundown=-12)
+    sunset = sunset.reshape(2, len(transits), len(lat))
+    sunrise = sunrise.reshape(2, len(transits), len(lat))
+
+    # target rise/set at each coordinate, shape (2, transits, coordinates)
+    target_rise, target_set, never_visible, always_visible = mini_staralt.target_rise_set_batch(
+        [[[date] for date in dates], [[date] for date in dates_prev]], ra=ra, dec=dec, lon=lon, lat=lat,
+        mintargetalt=20)
+
+    visible = night_visibility(center, ingress, egress, sunset, sunrise, target_rise, target_set, always_visible[0])
+    return visible.any(axis=1)
+
+
 class Transit2:
     """
     Transit2 object, need to merge with Transit eventually
@@ -280,64 +726,7 @@ class Transit2:
         Checks visibility of a Transit2 object from somewhere on Earth
         :return:
         """
-        import mini_staralt
-        import datetime
-
-        # latitude and longitude combinations that cover entire globe
-        latitudes = [45, 0, -45]
-        longitudes = [0, 60, 120, 150, 180, 240, 300]
-        accept = False
-
-        while not accept:
-            # loop through all combinations of lat and lon
-            for lat in latitudes:
-                for lon in longitudes:
-                    # check for night at coordinate
-                    sun_down = False
-                    sunset, sunrise = mini_staralt.sun_set_rise(
-                        self.center.replace(hour=0, second=0, minute=0, microsecond=0), lon=lon, lat=lat, sundown=-12)
-                    # check sunrise/set against in/egress
-                    if self.ingress > sunset:
-                        if self.egress < sunrise:
-                            sun_down = True
-                    # if calculation made for wrong day, step back and recalculate
-                    elif sunset > self.center:
-                        sunset, sunrise = mini_staralt.sun_set_rise(
-                            self.center.replace(hour=0, second=0, minute=0, microsecond=0) - datetime.timedelta(
-                                days=1),
-                            lon=lon, lat=lat, sundown=-12)
-                        # check sunrise/set against in/egress
-                        if self.ingress > sunset:
-                            if self.egress < sunrise:
-                                sun_down = True
-
-                    if sun_down:  # continue only if night at location
-                        try:
-                            target_rise, target_set = mini_staralt.target_rise_set(
-                                self.center.replace(hour=0, minute=0, second=0, microsecond=0),
-                                ra=self.ra, dec=self.dec, mintargetalt=20, lon=lon, lat=lat)
-                            # check target rise/set against in/egress
-                            if self.ingress > target_rise:
-                                if self.egress < target_set:
-                                    accept = True
-                            # if calculation made for wrong day, step back and recalculate
-                            elif target_rise > self.center:
-                                target_rise, target_set = mini_staralt.target_rise_set(
-                                    self.center.replace(hour=0, minute=0, second=0, microsecond=0) - datetime.timedelta(days=1),
-                                    ra=self.ra, dec=self.dec, mintargetalt=20, lon=lon, lat=lat)
-                                # check target rise/set against in/egress
-                                if self.ingress > target_rise:
-                                    if self.egress < target_set:
-                                        accept = True
-
-                        except mini_staralt.NeverVisibleError:
-                            pass
-                        except mini_staralt.AlwaysVisibleError:
-                            # target is always visible
-                            accept = True
-
-            break
-        return accept
+        return bool(check_visibility_general_batch([self])[0])
 
 
 def find_highest_id(ids_raw):
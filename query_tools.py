@@ -166,6 +166,7 @@ class Target:
         :param db: Database: database
         """
         import sqlite3
+        import data_tools
         # check for new data and store in database
         if self.query_depth is not None:
             cursor.execute('UPDATE TARGET_DATA SET Depth = '+str(self.query_depth)+' WHERE Name = \''+self.name+'\'')
@@ -186,9 +187,10 @@ class Target:
             # store each observation in table for target
             for ob in self.ETD_obs:
                 try:
-                    cursor.execute('INSERT INTO \''+self.name+'\' VALUES ('+ob.obnumber+', '+str(ob.epoch)+', '+str(ob.tmid)+\
-                    ', '+str(ob.tmid_err)+', NULL, NULL, '+str(ob.depth)+', '+str(ob.depth_err)+', '+str(ob.duration)+', '+\
-                    str(ob.duration_err)+', \'ETD\')')
+                    data_tools.insert_observation(cursor, self.name, {
+                        'ObID': float(ob.obnumber), 'Epoch': ob.epoch, 'ObsCenter': ob.tmid, 'ObsCenterErr': ob.tmid_err,
+                        'ObsDepth': ob.depth, 'ObsDepthErr': ob.depth_err, 'ObsDuration': ob.duration,
+                        'ObsDurationErr': ob.duration_err, 'Source': 'ETD'})
                 except sqlite3.IntegrityError:
                     print('Obs No. '+str(ob.obnumber)+' already exists')
         db.commit()
@@ -13,27 +13,60 @@
 #################################################################
 
 
-def parse_arguments():
+def parse_arguments(argv=None):
     """
     Allows arguments to be parsed when this method is called. These arguments specify the setup for the simulation
+    :param argv: Arguments to parse, None to read the command line: list of str
     :return: threshold: accuracy threshold to be used as the cutoff in the simulation
     :return: telescope_file: name of the .csv file containing the telescopes to be used in the simulation
     :return: mode: operating mode for the simulation, controls the amount of telescope time to be used
+    :return: args: all parsed arguments, including optional settings
     """
     import argparse
+    import os
     parser = argparse.ArgumentParser(description='Run simulation')
     # specify arguments to be collected
     parser.add_argument('threshold', type=int, help='Accuracy threshold')  # name of file, not location
     parser.add_argument('telescopes', type=str, help='file containing telescope data for simulation')
     parser.add_argument('mode', type=str, help='Operating mode')
-    args = parser.parse_args()  # collect arguments
-    telescope_file = '../telescopes/' + args.telescopes  # add location of telescope file to name
+    parser.add_argument('--cache', type=int, default=0, help='Number of sun and target rise/set results to cache, '
+                                                             'one for each date, site and target, 0 to disable')
+    parser.add_argument('--time-format', type=str, choices=['text', 'jd', 'seconds'], default=None,
+                        help='Store transit and schedule times as datetime text, JD - 2400000, or seconds since 1970,'
+                             ' default keeps the format of the clean database')
+    parser.add_argument('--in-memory', action='store_true', help='Run the simulation on a copy of the database in '
+                                                                 'memory, writing it to disk at the end')
+    parser.add_argument('--flush-weeks', type=int, default=0, help='Write the in-memory database to disk at the first '
+                                                                   'checkpoint after this many simulated weeks, 0 for '
+                                                                   'only at the end')
+    parser.add_argument('--durability', type=str, choices=['safe', 'wal', 'fast'], default='safe',
+                        help='Journal and sync setting for the database file, fast is only safe against crashes of '
+                             'the simulation, not of the machine')
+    parser.add_argument('--base-dir', type=str, default='.', help='Folder containing clean/ and telescopes/, where '
+                                                                  'the simulation folder and results.db are written')
+    parser.add_argument('--ephemeris-dir', type=str, default=None,
+                        help='Folder of night tables shared between simulations, built if missing. Target rise/set '
+                             'windows are not shared, each simulation calculates them for its own forecast transits')
+    parser.add_argument('--seed', type=int, default=None, help='Seed for the random observation outcomes, default '
+                                                               'fresh entropy')
+    parser.add_argument('--stream', type=int, default=None, help='Independent stream of the seed to use, e.g. '
+                                                                 'replica or worker number')
+    parser.add_argument('--checkpoints', type=int, default=None,
+                        help='Number of forecasting periods between checkpoints, each committed with the database, 0 '
+                             'to commit every week without checkpoints, default commits every week with a checkpoint')
+    parser.add_argument('--resume', action='store_true', help='Continue from the latest checkpoint of an existing '
+                                                              'simulation folder, starting again if it has none')
+    parser.add_argument('--timing', action='store_true', help='Record time spent in each phase of every simulated '
+                                                              'week, written next to the results csv')
+    parser.add_argument('--suffix', type=str, default='', help='Added to the simulation name, e.g. for replicas')
+    args = parser.parse_args(argv)  # collect arguments
+    telescope_file = os.path.join(args.base_dir, 'telescopes', args.telescopes)  # add location of telescope file
     mode = args.mode
     threshold = args.threshold
     print('Target threshold: ' + str(threshold))
     print('Operating mode: ' + str(mode))
     print('Obtaining telescopes from "' + telescope_file + '"')
-    return threshold, telescope_file, mode
+    return threshold, telescope_file, mode, args
 
 
 def create_simulation_name(telescope_file, threshold, mode):
@@ -44,27 +77,53 @@ def create_simulation_name(telescope_file, threshold, mode):
     :param mode: operating mode for the simulation, controls the amount of telescope time to be used
     :return: name of folder to be used for the simulation
     """
-    # stitch together name for simulation
-    sim_name = telescope_file.split('/')[-1].split('.')[0] + '_' + mode + '_' + str(threshold)
+    sim_name = simulation_name(telescope_file, threshold, mode)
     print('Simulation name: '+sim_name+', folder created')
     return sim_name
 
 
-def copy_database(sim_name):
+def simulation_name(telescope_file, threshold, mode):
+    """
+    Stitch together name for simulation from its settings
+    :param telescope_file: name of the .csv file containing the telescopes to be used in the simulation
+    :param threshold: accuracy threshold to be used as the cutoff in the simulation
+    :param mode: operating mode for the simulation, controls the amount of telescope time to be used
+    :return: name of folder to be used for the simulation
+    """
+    return telescope_file.split('/')[-1].split('.')[0] + '_' + mode + '_' + str(threshold)
+
+
+def copy_database(sim_name, time_format=None, base_dir='.', resume=False):
     """
     Create folder for new simulation and copy clean database into it, renaming as new simulation name
     :param sim_name: Name of simulation
-    :return: Name of database file generated
+    :param time_format: Format to store times in, None to keep the format of the clean database
+    :param base_dir: Folder containing clean/, where the simulation folder is made: str
+    :param resume: Keep an existing database that has reached a checkpoint, rather than starting again: bool
+    :return: Location of database file generated
     """
     import shutil
-    from os import mkdir
-    database_name = sim_name+'.db'  # add database suffix
+    import os
+    import sqlite3
+    import data_tools
+    import migrate_database
+    sim_dir = os.path.join(base_dir, sim_name)
+    database_name = os.path.join(sim_dir, sim_name+'.db')  # add database suffix
+    if resume and os.path.exists(database_name):
+        db = sqlite3.connect(database_name)
+        checkpoint = data_tools.read_checkpoint(db.cursor())
+        db.close()
+        if checkpoint is not None:
+            print('Resuming simulation in "' + database_name + '"')
+            return database_name
+        print('No checkpoint in "' + database_name + '", starting again')
     try:
-        shutil.rmtree(sim_name, ignore_errors=True)  # check for existing folder and remove
-        mkdir(sim_name)
-        shutil.copyfile('clean/clean3.db', sim_name + '/' + database_name)  # copy clean database and rename
+        shutil.rmtree(sim_dir, ignore_errors=True)  # check for existing folder and remove
+        os.mkdir(sim_dir)
+        shutil.copyfile(os.path.join(base_dir, 'clean', 'clean3.db'), database_name)  # copy clean database and rename
     except FileExistsError:
         pass
+    migrate_database.migrate(database_name, time_format)  # bring copy up to date with schema
 
     return database_name
 
@@ -83,24 +142,78 @@ def populate_telescopes(database):
         database.cursor.execute('CREATE TABLE IF NOT EXISTS ' + telescope[0] + '(Target VARCHAR(25), RA DECIMAL(16,8), '
                                 'Dec DECIMAL(16,8), ObsCenter DATETIME, RunStart DATETIME, RunEnd DATETIME, RunDuration'
                                 ' TIME, Epoch REAL, UNIQUE(RunStart))')  # create new table
+        database.schedule_index.pop(telescope[0], None)  # new table is empty
         print(telescope[0])
     print('Network has '+str(len(telescopes))+' telescopes')
     database.db.commit()
+    database.create_indexes()
+    # warn if any query made every interval would scan a whole table
+    for query, detail in database.check_query_plans():
+        print('WARNING: full table scan (' + detail + ') in ' + query)
 
 
-def run_simulation(database):
+def simulation_window(start_date):
+    """
+    Dates covered by a simulation starting at the earliest transit in its database
+    :param start_date: Start of simulation: datetime
+    :return end_date: End of simulation, after ARIEL launch: datetime
+    :return table_start: First date of night tables, the day before the start: datetime
+    :return table_end: Last date of night tables, covering the final intervals: datetime
+    """
+    from datetime import datetime, timedelta
+    end_date = datetime(year=2030, month=6, day=12)
+    return end_date, start_date - timedelta(days=1), end_date + timedelta(days=14)
+
+
+def prepare_ephemeris(telescope_file, clean_file, cache_dir):
+    """
+    Build the shared night tables used by simulations of a telescope network, so that simulations run
+    afterwards only attach to them
+    :param telescope_file: Location of the .csv file containing the telescopes: str
+    :param clean_file: Location of the clean database simulations are copied from: str
+    :param cache_dir: Folder of ephemeris files: str
+    """
+    import sqlite3
+    import data_tools
+    import database_generator
+    import observation_tools
+    columns, rows = database_generator.load_data_from_csv(telescope_file)
+    telescopes = []
+    for row in rows:
+        telescope = observation_tools.Telescope()
+        telescope.gen_from_database([row[0], float(row[1]), float(row[2]), row[3], row[4]])
+        telescopes.append(telescope)
+
+    # read clean database without changing it
+    db = sqlite3.connect('file:' + clean_file + '?mode=ro', uri=True)
+    cursor = db.cursor()
+    start_date = data_tools.value_to_time(cursor.execute('SELECT MIN(Center) FROM DEEP_TRANSITS').fetchone()[0],
+                                          data_tools.read_time_format(cursor))
+    db.close()
+
+    end_date, table_start, table_end = simulation_window(start_date)
+    observation_tools.NightTable(telescopes, table_start, table_end, cache_dir=cache_dir)
+
+
+def run_simulation(database, flush_weeks=0, ephemeris_dir=None, checkpoints=None, resume=False):
     """
     Run network simulation over duration of follow-up period
     :param database: Database object connected to database file
+    :param flush_weeks: Number of weeks between writing the database to disk, 0 for never: int
+    :param ephemeris_dir: Folder of ephemeris files shared between simulations, None to calculate in memory: str
+    :param checkpoints: Number of forecasting periods between checkpoints, 0 to commit every week without them, None
+    to commit every week with a checkpoint: int
+    :param resume: Continue from the latest checkpoint stored in the database: bool
     :return counts: Array of the number of constrained targets at every forecasting period
     :return totals: Array of the total number of targets at every forecasting period
     :return dates: Array of the dates for every forecasting period
     """
-    from datetime import datetime, timedelta
+    from datetime import timedelta
     start_date = database.find_earliest_date()  # start simulation at the date of the earliest transit in the database
-    end_date = datetime(year=2030, month=6, day=12)  # end of simulation after ARIEL launch
+    end_date, table_start, table_end = simulation_window(start_date)  # end of simulation after ARIEL launch
 
-    print('Running simulation from '+str(start_date.date())+' until '+str(end_date))
+    # calculate night windows for every telescope once, covering the day before the start and the final intervals
+    database.build_night_table(table_start, table_end, ephemeris_dir)
 
     #  set counter and interval for forecasting period
     time_since_forecast = timedelta(days=0)
@@ -112,37 +225,71 @@ def run_simulation(database):
     totals = []
     counts = []
     dates = []
+    if resume:
+        saved_date, saved_since, saved_counts, saved_totals, saved_dates = database.load_checkpoint()
+        if saved_date is not None:
+            current_date, time_since_forecast, counts, totals, dates = saved_date, saved_since, saved_counts, \
+                                                                       saved_totals, saved_dates
+            print('Resuming from checkpoint on '+str(current_date.date()))
+
+    print('Running simulation from '+str(current_date.date())+' until '+str(end_date))
     interval = timedelta(days=7)  # set interval for scheduling interval
+    weeks = 0
     while current_date < end_date:  # loop while date is within simulation
         current_date += interval  # increment date
-        database.increment_total_night(current_date, interval)
-        database.make_schedules(current_date, interval, database.mode)  # make schedules for the scheduling interval
-        database.simulate_observations(current_date, interval)  # simulate the observations
+        weeks += 1
+        timer = database.timer
+        with timer.phase('increment_total_night'):
+            database.increment_total_night(current_date, interval)
+        with timer.phase('make_schedules'):
+            database.make_schedules(current_date, interval, database.mode)  # make schedules for the scheduling interval
+        with timer.phase('simulate_observations'):
+            database.simulate_observations(current_date, interval)  # simulate the observations
         time_since_forecast += interval  # increment forecast counter
+        checkpoint = checkpoints is None  # every week is a checkpoint by default
         if time_since_forecast >= limit:  # check forecast counter
             print('Forecasting on:', current_date)
-            database.transit_forecast(current_date, current_date + limit)
+            with timer.phase('transit_forecast'):
+                database.transit_forecast(current_date, current_date + limit)
             time_since_forecast = timedelta(days=0)
 
             # find constrained and total targets and store in arrays with date
-            count, total = database.check_constrained(current_date)
+            with timer.phase('check_constrained'):
+                count, total = database.check_constrained(current_date)
             counts.append(count)
             totals.append(total)
             dates.append(current_date.date())
+            if checkpoints is not None:
+                checkpoint = checkpoints > 0 and len(dates) % checkpoints == 0
+
+        if checkpoint:
+            # saved in the same transaction as the weeks since the last checkpoint
+            database.save_checkpoint(current_date, time_since_forecast, counts, totals, dates)
+        if database.in_memory:
+            database.end_week()  # commit the week in one transaction
+            # only write to disk at checkpoints, so the file always matches its latest checkpoint
+            if flush_weeks > 0 and weeks >= flush_weeks and (checkpoint or checkpoints == 0):
+                database.flush()  # checkpoint to disk
+                weeks = 0
+        elif checkpoint or checkpoints == 0:
+            database.end_week()  # commit the weeks since the last checkpoint in one transaction
+        timer.end_week(current_date)
 
     print('Simulation finished, constrained '+str(counts[-1])+'/'+str(totals[-1])+' targets')
     return counts, totals, dates
 
 
-def write_count_results(counts, totals, dates, sim_name):
+def write_count_results(counts, totals, dates, sim_name, sim_dir='.'):
     """
     Write running totals of constrained and total targets, with dates to a csv file
     :param counts: Array of the number of constrained targets at every forecasting period
     :param totals: Array of the total number of targets at every forecasting period
     :param dates: Array of the dates for every forecasting period
     :param sim_name: Name of simulation
+    :param sim_dir: Folder of the simulation: str
     """
-    outfile = sim_name+'.csv'  # generate filename for data
+    import os
+    outfile = os.path.join(sim_dir, sim_name+'.csv')  # generate filename for data
     # write results to file
     with open(outfile, 'w') as f:
         f.write('# Date\tNoObserved\tNoTargets')
@@ -151,21 +298,51 @@ def write_count_results(counts, totals, dates, sim_name):
     f.close()
 
 
-def main():
-    from os import chdir
+def main(argv=None):
+    """
+    Run a single simulation, working in its own folder without changing the working directory, so several can run
+    in one process
+    :param argv: Arguments as given on the command line, None to read the command line: list of str
+    :return counts: Array of the number of constrained targets at every forecasting period
+    :return totals: Array of the total number of targets at every forecasting period
+    :return dates: Array of the dates for every forecasting period
+    """
+    import os
     import actions
-    threshold, telescope_file, mode = parse_arguments()  # collect arguments
-    sim_name = create_simulation_name(telescope_file, threshold, mode)  # generate simulation name
-    database_name = copy_database(sim_name)  # create new database file
-    chdir(sim_name)
+    import data_tools
+    import mini_staralt
+    import observation_tools
+    import timing_tools
+    threshold, telescope_file, mode, args = parse_arguments(argv)  # collect arguments
+    if args.cache > 0:
+        mini_staralt.enable_cache(args.cache)
+    sim_name = create_simulation_name(telescope_file, threshold, mode) + args.suffix  # generate simulation name
+    # create new database file, or keep the existing one when resuming
+    database_name = copy_database(sim_name, args.time_format, args.base_dir, args.resume)
+    sim_dir = os.path.join(args.base_dir, sim_name)
 
     # create Database object connected to database file
-    database = actions.Database(database_name, telescope_file, mode, threshold)
-    populate_telescopes(database)
+    rng = observation_tools.make_rng(args.seed, args.stream)  # random outcomes for this simulation, replaced on resume
+    database = actions.Database(database_name, telescope_file, mode, threshold, in_memory=args.in_memory,
+                                durability=args.durability, rng=rng,
+                                timer=timing_tools.PhaseTimer() if args.timing else None)
+    resume = args.resume and data_tools.read_checkpoint(database.cursor) is not None
+    if not resume:
+        populate_telescopes(database)
 
-    counts, totals, dates = run_simulation(database)
-    write_count_results(counts, totals, dates, sim_name)
-    database.store_results(counts[-1], totals[-1])
+    counts, totals, dates = run_simulation(database, args.flush_weeks if args.in_memory else 0, args.ephemeris_dir,
+                                           args.checkpoints, resume)
+    write_count_results(counts, totals, dates, sim_name, sim_dir)
+    database.store_results(counts[-1], totals[-1], os.path.join(args.base_dir, 'results.db'))
+    database.flush()  # write in-memory database to disk
+    database.db.close()
+    if args.timing:
+        database.timer.write_csv(os.path.join(sim_dir, sim_name + '_timing.csv'))
+        database.timer.write_json(os.path.join(sim_dir, sim_name + '_timing.json'))
+        print(database.timer.summary())
+    if mini_staralt.cache is not None:
+        print(mini_staralt.cache.report())
+    return counts, totals, dates
 
 
 if __name__ == '__main__':
@@ -0,0 +1,202 @@
+#################################################################
+# Code to run a sweep of simulations over accuracy thresholds,  #
+# telescope networks and operating modes                        #
+# Runs every combination with run_sim.py in a pool of processes #
+# sized to the machine, retrying any that fail                  #
+# Replaces the .cmd files written by bash_builder.py            #
+#################################################################
+
+
+def parse_arguments():
+    """
+    Allows arguments to be parsed when this method is called. These arguments specify the simulations in the sweep
+    :return: args: all parsed arguments
+    """
+    import argparse
+    parser = argparse.ArgumentParser(description='Run a sweep of simulations in parallel')
+    parser.add_argument('--thresholds', type=int, nargs='+', default=None, help='Accuracy thresholds to run')
+    parser.add_argument('--threshold-range', type=int, nargs='+', default=[3, 10], metavar='N',
+                        help='Start, stop and optional step of accuracy thresholds, used if --thresholds not given')
+    parser.add_argument('--networks', type=str, nargs='+', default=None,
+                        help='Telescope files to run, default all files in telescopes/')
+    parser.add_argument('--modes', type=str, nargs='+',
+                        default=['unlimited', '1perweek', '2perweek', '3perweek', '4perweek'], help='Operating modes')
+    parser.add_argument('--workers', type=int, default=None, help='Number of processes, default one per core')
+    parser.add_argument('--retries', type=int, default=1, help='Number of times to rerun a failed simulation')
+    parser.add_argument('--skip-finished', action='store_true',
+                        help='Skip simulations that have already written their csv file')
+    parser.add_argument('--seed', type=int, default=None, help='Seed of the sweep, each simulation using its own '
+                                                               'spawned stream, default fresh entropy')
+    parser.add_argument('--base-dir', type=str, default='.', help='Folder containing clean/ and telescopes/')
+    parser.add_argument('--ephemeris-dir', type=str, default=None,
+                        help='Folder for night tables built once and shared by every simulation. Target rise/set '
+                             'windows are not shared, each simulation calculates them for its own forecast transits')
+    parser.add_argument('--sim-args', type=str, nargs='...', default=[],
+                        help='Further options passed to run_sim.py for every simulation, e.g. --in-memory')
+    return parser.parse_args()
+
+
+def list_networks(base_dir):
+    """
+    Find all telescope files available for simulations
+    :param base_dir: Folder containing telescopes/: str
+    :return: Names of telescope files: list of str
+    """
+    import os
+    networks = [name for name in os.listdir(os.path.join(base_dir, 'telescopes')) if name.endswith('.csv')]
+    networks.sort()
+    return networks
+
+
+def build_sweep(thresholds, networks, modes):
+    """
+    List every combination of settings in the sweep
+    :param thresholds: Accuracy thresholds: list of ints
+    :param networks: Names of telescope files: list of str
+    :param modes: Operating modes: list of str
+    :return: List of (threshold, network, mode) tuples
+    """
+    sims = []
+    for threshold in thresholds:
+        for network in networks:
+            for mode in modes:
+                sims.append((int(threshold), network, mode))
+    return sims
+
+
+def run_one(threshold, network, mode, base_dir, sim_args, retries, suffix=''):
+    """
+    Run a single simulation with its output written to a log file, retrying from its last checkpoint if it fails
+    :param threshold: Accuracy threshold: int
+    :param network: Name of telescope file: str
+    :param mode: Operating mode: str
+    :param base_dir: Folder containing clean/ and telescopes/: str
+    :param sim_args: Further options for run_sim.py: list of str
+    :param retries: Number of times to rerun after a failure: int
+    :param suffix: Added to the simulation name: str
+    :return success: True if the simulation finished: bool
+    :return result: (counts, totals, dates) if finished, otherwise the last error: tuple or str
+    :return attempts: Number of times the simulation was run: int
+    """
+    import os
+    import contextlib
+    import traceback
+    import run_sim
+    argv = [str(threshold), network, mode, '--base-dir', base_dir, '--suffix', suffix] + list(sim_args)
+    sim_name = run_sim.simulation_name(network, threshold, mode) + suffix
+    os.makedirs(os.path.join(base_dir, 'logs'), exist_ok=True)
+    log_file = os.path.join(base_dir, 'logs', sim_name + '.log')
+
+    error = None
+    for attempt in range(1, retries + 2):
+        with open(log_file, 'a' if attempt > 1 else 'w') as log, contextlib.redirect_stdout(log):
+            try:
+                # reruns continue from the last checkpoint of the failed attempt
+                result = run_sim.main(argv + ['--resume'] if attempt > 1 else argv)
+                return True, result, attempt
+            except Exception:
+                error = traceback.format_exc()
+                print(error)
+    return False, error.strip().split('\n')[-1], retries + 1
+
+
+def is_finished(threshold, network, mode, base_dir):
+    """
+    Check whether a simulation has already written its csv file
+    :param threshold: Accuracy threshold: int
+    :param network: Name of telescope file: str
+    :param mode: Operating mode: str
+    :param base_dir: Folder containing the simulation folders: str
+    :return: True if finished: bool
+    """
+    import os
+    import run_sim
+    sim_name = run_sim.simulation_name(network, threshold, mode)
+    return os.path.exists(os.path.join(base_dir, sim_name, sim_name + '.csv'))
+
+
+def prepare_ephemeris(base_dir, networks, cache_dir):
+    """
+    Build the shared night tables for each telescope network before any simulation starts
+    :param base_dir: Folder containing clean/ and telescopes/: str
+    :param networks: Names of telescope files: list of str
+    :param cache_dir: Folder of ephemeris files: str
+    """
+    import os
+    import time
+    import run_sim
+    for network in networks:
+        start = time.time()
+        run_sim.prepare_ephemeris(os.path.join(base_dir, 'telescopes', network),
+                                  os.path.join(base_dir, 'clean', 'clean3.db'), cache_dir)
+        print('Ephemeris for ' + network + ' ready in ' + str(round(time.time() - start)) + 's')
+
+
+def run_sweep(sims, base_dir='.', sim_args=(), workers=None, retries=1, seed=None):
+    """
+    Run simulations in a pool of processes, reporting progress as each finishes
+    :param sims: List of (threshold, network, mode) tuples
+    :param base_dir: Folder containing clean/ and telescopes/: str
+    :param sim_args: Further options for run_sim.py: list of str
+    :param workers: Number of processes, None for one per core: int
+    :param retries: Number of times to rerun a failed simulation: int
+    :param seed: Seed of the sweep, simulation i using stream i, None for fresh entropy: int
+    :return: List of (threshold, network, mode) tuples for simulations that failed
+    """
+    import os
+    import time
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(sims)))
+    print('Running ' + str(len(sims)) + ' simulations on ' + str(workers) + ' processes')
+
+    failed = []
+    start = time.time()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        for i, sim in enumerate(sims):
+            seed_args = [] if seed is None else ['--seed', str(seed), '--stream', str(i)]
+            futures[pool.submit(run_one, sim[0], sim[1], sim[2], base_dir, list(sim_args) + seed_args, retries)] = sim
+        for done, future in enumerate(as_completed(futures), start=1):
+            sim = futures[future]
+            try:
+                success, result, attempts = future.result()
+            except Exception as e:  # worker process died
+                success, result, attempts = False, repr(e), 1
+            elapsed = time.time() - start
+            if success:
+                status = 'constrained ' + str(result[0][-1]) + '/' + str(result[1][-1])
+            else:
+                status = 'FAILED after ' + str(attempts) + ' attempts: ' + str(result)
+                failed.append(sim)
+            print('[' + str(done) + '/' + str(len(sims)) + ', ' + str(round(elapsed)) + 's] ' + str(sim[0]) + ' ' +
+                  sim[1] + ' ' + sim[2] + ': ' + status)
+    return failed
+
+
+def main():
+    import numpy as np
+    args = parse_arguments()
+    if args.thresholds is not None:
+        thresholds = args.thresholds
+    else:
+        thresholds = np.arange(*args.threshold_range)
+    networks = args.networks if args.networks is not None else list_networks(args.base_dir)
+    sims = build_sweep(thresholds, networks, args.modes)
+    if args.skip_finished:
+        sims = [sim for sim in sims if not is_finished(sim[0], sim[1], sim[2], args.base_dir)]
+
+    sim_args = list(args.sim_args)
+    if args.ephemeris_dir is not None:
+        prepare_ephemeris(args.base_dir, sorted(set(sim[1] for sim in sims)), args.ephemeris_dir)
+        sim_args += ['--ephemeris-dir', args.ephemeris_dir]
+
+    failed = run_sweep(sims, args.base_dir, sim_args, args.workers, args.retries, args.seed)
+    print('Sweep finished, ' + str(len(sims) - len(failed)) + '/' + str(len(sims)) + ' simulations succeeded')
+    for sim in failed:
+        print('Failed: ' + str(sim[0]) + ' ' + sim[1] + ' ' + sim[2])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+#################################################################
+# Code to generate synthetic targets and telescope networks     #
+# for scale testing without any network access                  #
+# Writes a catalog csv in the same format as the real catalog,  #
+# a clean database with fitted periods and initial forecast as  #
+# made by database_generator.py, and a telescope csv file for   #
+# each network size requested                                   #
+#################################################################
+
+# Columns of TARGET_DATA, in the order of the real catalog csv
+TARGET_COLUMNS = ['Name', 'RA', 'Dec', 'Depth', 'DepthErr', 'DepthSource', 'Duration', 'PeriodStart', 'PeriodStartErr',
+                  'FitPeriod', 'FitPeriodErr', 'CurrentPeriod', 'CurrentPeriodErr', 'TruePeriod', 'TruePeriodErr',
+                  'TrueEpoch', 'TrueLastObs', 'TrueLastObsErr', 'LastObs', 'LastObsErr', 'LastEpoch', 'NoOfObs',
+                  'ErrAtAriel', 'PercentLoss', 'LossAtAriel', 'ErrAtArielStart', 'PercentLossStart',
+                  'LossAtArielStart']
+
+TELESCOPE_COLUMNS = ['Name', 'Lat', 'Lon', 'Alt', 'Aperture']
+
+
+def parse_arguments():
+    """
+    Allows arguments to be parsed when this method is called. These arguments specify the synthetic data
+    :return: args: all parsed arguments
+    """
+    import argparse
+    parser = argparse.ArgumentParser(description='Generate a synthetic clean database and telescope networks')
+    parser.add_argument('--targets', type=int, default=1000, help='Number of synthetic targets')
+    parser.add_argument('--telescopes', type=int, nargs='+', default=[10],
+                        help='Number of sites in each network, smaller networks are the first sites of larger ones')
+    parser.add_argument('--max-obs', type=int, default=10, help='Largest number of observations of a target before '
+                                                                'the simulation')
+    parser.add_argument('--start', type=str, default=None, help='Date of initial forecast, and so of the start of '
+                                                                'simulations, as YYYY-MM-DD, default today')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the synthetic data')
+    parser.add_argument('--base-dir', type=str, default='.', help='Folder to write clean/ and telescopes/ into')
+    return parser.parse_args()
+
+
+def generate_targets(rng, count, max_obs=10):
+    """
+    Draw targets spread evenly over the sky with random period, depth and duration, and a history of observations
+    ending with the last observation, between 2014 and 2019, for targets observed at least once
+    :param rng: Random number generator: Generator
+    :param count: Number of targets: int
+    :param max_obs: Largest number of observations of a target before the simulation: int
+    :return targets: Values of each column of TARGET_DATA for each target, '' for missing: list of dicts
+    :return observations: (name, values) pairs for each observation, values for each column of OBSERVATIONS
+    """
+    import numpy as np
+    ras = rng.uniform(0.0, 360.0, count)
+    decs = np.degrees(np.arcsin(rng.uniform(-1.0, 1.0, count)))  # uniform over the sphere
+    periods = np.exp(rng.uniform(np.log(0.5), np.log(10.0), count))
+    period_errs = np.exp(rng.uniform(np.log(1e-6), np.log(1e-4), count))
+    depths = rng.uniform(2.0, 30.0, count)
+    durations = rng.uniform(60.0, 300.0, count)  # minutes
+    last_obs = rng.uniform(56658.5, 58849.5, count)  # 2014 to 2019 in JD - 2400000
+    last_obs_errs = rng.uniform(1e-4, 2e-3, count)
+    no_of_obs = rng.integers(0, max_obs + 1, count)
+
+    targets = []
+    observations = []
+    width = max(6, len(str(count)))
+    for i in range(count):
+        name = str(i + 1).zfill(width) + 'b'  # names only contain numbers, so are never queried
+        row = dict.fromkeys(TARGET_COLUMNS, '')
+        row.update({'Name': name, 'RA': float(ras[i]), 'Dec': float(decs[i]), 'Depth': float(depths[i]),
+                    'DepthSource': 'Synthetic', 'Duration': float(durations[i]), 'PeriodStart': float(periods[i]),
+                    'PeriodStartErr': float(period_errs[i]), 'LastObs': float(last_obs[i]),
+                    'LastObsErr': float(last_obs_errs[i]), 'LastEpoch': 0, 'NoOfObs': int(no_of_obs[i]),
+                    'LossAtArielStart': 0})
+        targets.append(row)
+
+        # last observation at epoch 0, with earlier ones at irregular gaps before it and timing noise
+        epochs = -np.cumsum(np.concatenate(([0], rng.integers(5, 100, max(no_of_obs[i] - 1, 0)))))[:no_of_obs[i]]
+        errs = rng.uniform(3e-4, 2e-3, len(epochs))
+        centers = last_obs[i] + periods[i] * epochs + rng.normal(0.0, errs)
+        if len(epochs) > 0:
+            centers[0], errs[0] = last_obs[i], last_obs_errs[i]
+        for epoch, center, err in zip(epochs, centers, errs):
+            observations.append((name, {'Epoch': int(epoch), 'ObsCenter': float(center), 'ObsCenterErr': float(err),
+                                        'Source': 'Synthetic'}))
+    return targets, observations
+
+
+def generate_telescopes(rng, count):
+    """
+    Draw sites spread over the inhabited latitudes, with random altitude and aperture
+    :param rng: Random number generator: Generator
+    :param count: Number of sites: int
+    :return: Name, Lat, Lon, Alt and Aperture of each site: list of lists
+    """
+    import numpy as np
+    lats = np.degrees(np.arcsin(rng.uniform(np.sin(np.radians(-55.0)), np.sin(np.radians(65.0)), count)))
+    lons = rng.uniform(-180.0, 180.0, count)
+    alts = rng.uniform(0.0, 4500.0, count)
+    apertures = rng.integers(0, 2, count)
+    width = max(3, len(str(count)))
+    return [['Site' + str(i + 1).zfill(width), round(float(lats[i]), 4), round(float(lons[i]), 4), int(alts[i]),
+             int(apertures[i])] for i in range(count)]
+
+
+def write_catalog_csv(targets, filename):
+    """
+    Write targets to a csv file in the format of the real catalog
+    :param targets: Values of each column of TARGET_DATA for each target: list of dicts
+    :param filename: Location of file: str
+    """
+    with open(filename, 'w') as f:
+        f.write(','.join(TARGET_COLUMNS))
+        for row in targets:
+            f.write('\n' + ','.join(str(row[column]) for column in TARGET_COLUMNS))
+        f.write('\n')
+
+
+def write_telescope_csv(telescopes, filename):
+    """
+    Write sites to a telescope csv file read by run_sim.py
+    :param telescopes: Name, Lat, Lon, Alt and Aperture of each site: list of lists
+    :param filename: Location of file: str
+    """
+    with open(filename, 'w') as f:
+        f.write(','.join(TELESCOPE_COLUMNS))
+        for row in telescopes:
+            f.write('\n' + ','.join(str(value) for value in row))
+        f.write('\n')
+
+
+def build_clean_database(database_name, catalog_file, observations, start):
+    """
+    Generate a clean database from a catalog csv file and its observations, with periods fitted, errors propagated
+    to ARIEL launch and transits forecast for the four weeks from the start date, as database_generator.py does for
+    the real catalog after its queries
+    :param database_name: Location of database file, replaced if it exists: str
+    :param catalog_file: Location of catalog csv file: str
+    :param observations: (name, values) pairs for each observation, values for each column of OBSERVATIONS
+    :param start: Date of initial forecast: datetime
+    """
+    import os
+    import sqlite3
+    import data_tools
+    import database_generator
+    import actions
+    from datetime import timedelta
+    if os.path.exists(database_name):
+        os.remove(database_name)
+    db = sqlite3.connect(database_name)
+    cursor = db.cursor()
+    database_generator.generate_sql_table_from_csv(catalog_file, 'TARGET_DATA', cursor)
+    data_tools.create_obs_table(cursor)
+    for obid, (name, values) in enumerate(observations, start=1):
+        values['ObID'] = obid
+        data_tools.insert_observation(cursor, name, values)
+    db.commit()
+    db.close()
+
+    # no telescopes are needed until a simulation is run
+    database = actions.Database(database_name, '', 'unlimited', 0)
+    database.initial_period_fit()
+    database.initial_prop_to_ariel()
+    database.transit_forecast(start, start + timedelta(days=28))
+    database.db.commit()
+    database.db.close()
+
+
+def generate(base_dir, targets, telescopes, start, seed=0, max_obs=10):
+    """
+    Write a synthetic catalog and clean database into clean/, and a network for each size into telescopes/
+    :param base_dir: Folder to write into, as used by run_sim.py: str
+    :param targets: Number of targets: int
+    :param telescopes: Number of sites in each network: list of ints
+    :param start: Date of initial forecast: datetime
+    :param seed: Seed for the synthetic data: int
+    :param max_obs: Largest number of observations of a target before the simulation: int
+    :return: Location of clean database: str
+    """
+    import os
+    import numpy as np
+    target_rng, telescope_rng = [np.random.default_rng(seed_sequence) for seed_sequence in
+                                 np.random.SeedSequence(seed).spawn(2)]
+    os.makedirs(os.path.join(base_dir, 'clean'), exist_ok=True)
+    os.makedirs(os.path.join(base_dir, 'telescopes'), exist_ok=True)
+
+    # networks share their first sites, so larger networks only add telescopes
+    sites = generate_telescopes(telescope_rng, max(telescopes))
+    for count in telescopes:
+        telescope_file = os.path.join(base_dir, 'telescopes', 'synthetic' + str(count) + '.csv')
+        write_telescope_csv(sites[:count], telescope_file)
+        print('Network of ' + str(count) + ' telescopes written to ' + telescope_file)
+
+    target_rows, observations = generate_targets(target_rng, targets, max_obs)
+    catalog_file = os.path.join(base_dir, 'clean', 'synthetic_catalog.csv')
+    write_catalog_csv(target_rows, catalog_file)
+    print(str(targets) + ' targets with ' + str(len(observations)) + ' observations written to ' + catalog_file)
+
+    database_name = os.path.join(base_dir, 'clean', 'clean3.db')
+    build_clean_database(database_name, catalog_file, observations, start)
+    print('Clean database written to ' + database_name)
+    return database_name
+
+
+def main():
+    from datetime import datetime
+    args = parse_arguments()
+    if args.start is not None:
+        start = datetime.strptime(args.start, '%Y-%m-%d')
+    else:
+        start = datetime.today()
+    generate(args.base_dir, args.targets, args.telescopes, start, args.seed, args.max_obs)
+
+
+if __name__ == '__main__':
+    main()
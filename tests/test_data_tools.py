@@ -0,0 +1,65 @@
+def launch_jd():
+    """
+    ARIEL launch in JD - 2400000, calculated as prop_forwards originally did
+    """
+    import datetime
+    import julian
+    return julian.to_jd(datetime.datetime(year=2029, month=6, day=12, hour=0, minute=0, second=0), fmt='jd') - 2400000
+
+
+def loop_err(tmid, tmid_err, period, period_err):
+    """
+    Propagated error at ARIEL launch, counting epochs one period at a time as prop_forwards originally did
+    """
+    import numpy as np
+    ariel_jd = launch_jd()
+    current = tmid
+    count = 0  # counter for epochs required
+    while current < ariel_jd:  # loop towards it
+        count += 1  # count epochs
+        current += period  # increment date by period
+    return np.sqrt(tmid_err * tmid_err + count * count * period_err * period_err)
+
+
+def test_prop_forwards_boundary_matches_loop():
+    import data_tools
+    period = 3.123456789
+    tmid = launch_jd() - 37 * period
+    err_tot, percent, loss = data_tools.prop_forwards(['1000b', period, 1e-4, tmid, 1e-3, 120.0])
+    assert err_tot == loop_err(tmid, 1e-3, period, 1e-4)
+
+
+def test_prop_forwards_launch_on_transit():
+    import data_tools
+    launch = launch_jd()
+    # the dyadic periods step onto launch exactly, so a transit falls at launch itself
+    for period in [0.5, 2.0, 3.123456789]:
+        for epochs in [1, 37, 1000]:
+            for offset in [0.0, 1e-9, -1e-9]:
+                tmid = launch - epochs * period + offset
+                err_tot, percent, loss = data_tools.prop_forwards(['1000b', period, 1e-4, tmid, 1e-3, 120.0])
+                assert err_tot == loop_err(tmid, 1e-3, period, 1e-4), (period, epochs, offset)
+                # one period either side of the boundary as well
+                for shift in [-period, period]:
+                    if tmid + shift < launch:
+                        err_tot, percent, loss = data_tools.prop_forwards(['1000b', period, 1e-4, tmid + shift,
+                                                                           1e-3, 120.0])
+                        assert err_tot == loop_err(tmid + shift, 1e-3, period, 1e-4), (period, epochs, offset, shift)
+
+
+def test_prop_forwards_batch_matches_loop_near_boundaries():
+    import numpy as np
+    import data_tools
+    launch = launch_jd()
+    rng = np.random.default_rng(0)
+    size = 5000
+    periods = rng.uniform(0.5, 10.0, size)
+    # transit centers a whole number of periods before launch, give or take a few rounding errors
+    offsets = rng.choice([0.0, 1e-11, -1e-11, 1e-9, -1e-9], size)
+    tmids = np.minimum(launch - rng.integers(1, 5000, size) * periods + offsets, launch - 1e-9)
+    period_errs = np.full(size, 1e-5)
+    tmid_errs = np.full(size, 1e-3)
+    err_tot, percent, loss = data_tools.prop_forwards_batch(periods, period_errs, tmids, tmid_errs,
+                                                            np.full(size, 100.0))
+    expected = [loop_err(*values) for values in zip(tmids, tmid_errs, periods, period_errs)]
+    assert np.array_equal(err_tot, expected)
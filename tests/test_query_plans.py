@@ -0,0 +1,47 @@
+def make_run_database(folder):
+    """
+    Build a small synthetic simulation database with telescopes populated and indexes created, as run_sim.py does
+    :param folder: Folder to build in: pathlib.Path
+    :return: Database object connected to the database
+    """
+    import contextlib
+    import io
+    from datetime import datetime
+    import actions
+    import run_sim
+    import synthetic_generator
+    with contextlib.redirect_stdout(io.StringIO()):
+        synthetic_generator.generate(str(folder), 30, [3], datetime(2029, 6, 12), seed=1)
+        database_name = run_sim.copy_database('plans', base_dir=str(folder))
+        database = actions.Database(database_name, str(folder / 'telescopes' / 'synthetic3.csv'), 'unlimited', 3)
+        run_sim.populate_telescopes(database)
+    return database
+
+
+def test_no_full_table_scans(tmp_path):
+    database = make_run_database(tmp_path)
+    try:
+        assert database.check_query_plans() == []
+    finally:
+        database.db.close()
+
+
+def test_forecast_in_insertion_order(tmp_path):
+    import contextlib
+    import io
+    from datetime import datetime, timedelta
+    database = make_run_database(tmp_path)
+    try:
+        database.cursor.execute('DELETE FROM DEEP_TRANSITS')
+        start = datetime(2029, 7, 10)
+        with contextlib.redirect_stdout(io.StringIO()):
+            database.transit_forecast(start, start + timedelta(days=28))
+        rows = database.cursor.execute('SELECT Name FROM DEEP_TRANSITS ORDER BY rowid').fetchall()
+        names = []
+        for row in rows:
+            if row[0] not in names:
+                names.append(row[0])
+        assert len(names) > 1
+        assert names == sorted(names)  # synthetic names are numbered in order of insertion into TARGET_DATA
+    finally:
+        database.db.close()
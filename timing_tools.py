@@ -0,0 +1,140 @@
+#################################################################
+# Code to record where time goes in the simulation loop         #
+# Keeps wall time and call counts for each phase of every       #
+# simulated week, written as a csv and json timeline next to    #
+# the results of the simulation, with a summary at the end      #
+#################################################################
+
+# phases of a simulated week, in the order they run
+# obtain_upcoming_transits and schedule are part of make_schedules, recalculate is part of simulate_observations
+PHASES = ['increment_total_night', 'make_schedules', 'obtain_upcoming_transits', 'schedule', 'simulate_observations',
+          'recalculate', 'transit_forecast', 'check_constrained']
+
+
+class PhaseTimer:
+    """
+    Timer object, accumulates wall time and calls for each phase during a simulated week, and stores a row of the
+    timeline at the end of every week
+    """
+    def __init__(self):
+        """
+        Null constructor, starts an empty timeline
+        """
+        self.week_times = {}
+        self.week_calls = {}
+        self.dates = []
+        self.times = []  # seconds spent in each phase during each week
+        self.calls = []  # calls of each phase during each week
+        self.week_start = None
+
+    def phase(self, name):
+        """
+        Time one call of a phase, used as a with statement around the call
+        :param name: Name of phase, from PHASES: str
+        :return: Context manager adding the time of the call to the current week
+        """
+        import time
+        from contextlib import contextmanager
+
+        @contextmanager
+        def timed():
+            start = time.perf_counter()
+            try:
+                yield
+            finally:
+                self.week_times[name] = self.week_times.get(name, 0.0) + time.perf_counter() - start
+                self.week_calls[name] = self.week_calls.get(name, 0) + 1
+        if self.week_start is None:
+            self.week_start = time.perf_counter()
+        return timed()
+
+    def end_week(self, date):
+        """
+        Store the times and calls of the week as a row of the timeline, and start the next week
+        :param date: Simulated date at the end of the week: datetime
+        """
+        import time
+        now = time.perf_counter()
+        times = dict(self.week_times)
+        times['week'] = now - self.week_start if self.week_start is not None else 0.0
+        self.dates.append(date)
+        self.times.append(times)
+        self.calls.append(dict(self.week_calls))
+        self.week_times = {}
+        self.week_calls = {}
+        self.week_start = now
+
+    def totals(self):
+        """
+        Sum the timeline over every week
+        :return times: Total seconds spent in each phase, and in whole weeks under 'week': dict
+        :return calls: Total calls of each phase: dict
+        """
+        times = {name: sum(week.get(name, 0.0) for week in self.times) for name in PHASES + ['week']}
+        calls = {name: sum(week.get(name, 0) for week in self.calls) for name in PHASES}
+        return times, calls
+
+    def write_csv(self, outfile):
+        """
+        Write the seconds and calls of each phase for every week to a csv file
+        :param outfile: Location of file: str
+        """
+        header = ['Date', 'WeekTime'] + [column for name in PHASES for column in (name + 'Time', name + 'Calls')]
+        with open(outfile, 'w') as f:
+            f.write('# ' + '\t'.join(header))
+            for date, times, calls in zip(self.dates, self.times, self.calls):
+                row = [str(date.date()), format(times['week'], '.6f')]
+                for name in PHASES:
+                    row += [format(times.get(name, 0.0), '.6f'), str(calls.get(name, 0))]
+                f.write('\n' + '\t'.join(row))
+
+    def write_json(self, outfile):
+        """
+        Write the timeline and its totals to a json file
+        :param outfile: Location of file: str
+        """
+        import json
+        times, calls = self.totals()
+        weeks = []
+        for date, week_times, week_calls in zip(self.dates, self.times, self.calls):
+            weeks.append({'Date': str(date.date()), 'WeekTime': week_times['week'],
+                          'Phases': {name: {'Time': week_times.get(name, 0.0), 'Calls': week_calls.get(name, 0)}
+                                     for name in PHASES}})
+        summary = {'Weeks': len(self.dates), 'WeekTime': times['week'],
+                   'Phases': {name: {'Time': times[name], 'Calls': calls[name]} for name in PHASES}}
+        with open(outfile, 'w') as f:
+            json.dump({'Summary': summary, 'Timeline': weeks}, f, indent=1)
+
+    def summary(self):
+        """
+        Table of the total time, calls and share of the loop spent in each phase
+        :return: Lines of the table: str
+        """
+        times, calls = self.totals()
+        total = times['week']
+        lines = ['Timing over ' + str(len(self.dates)) + ' weeks, ' + format(total, '.2f') + 's in total:']
+        for name in PHASES:
+            share = times[name] / total * 100 if total > 0 else 0.0
+            per_call = times[name] / calls[name] * 1000 if calls[name] > 0 else 0.0
+            lines.append('  ' + name.ljust(26) + format(times[name], '10.3f') + 's ' + format(share, '6.1f') + '% ' +
+                         str(calls[name]).rjust(8) + ' calls ' + format(per_call, '10.3f') + 'ms/call')
+        return '\n'.join(lines)
+
+
+class NullTimer:
+    """
+    Timer object that records nothing, used when timing is switched off
+    """
+    def phase(self, name):
+        """
+        :param name: Name of phase: str
+        :return: Context manager that does nothing
+        """
+        from contextlib import nullcontext
+        return nullcontext()
+
+    def end_week(self, date):
+        """
+        :param date: Simulated date at the end of the week: datetime
+        """
+        pass